@@ -0,0 +1,101 @@
+import random
+import string
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# Реальные слова — чтобы полнотекстовый поиск находил совпадения
+SEED_WORDS = (
+    'python django postgres redis docker kubernetes telegram deploy release backup '
+    'migration index query latency python3 asyncio sqlalchemy telethon embedding model '
+    'релиз сервер база данных запрос индекс ошибка задача проект команда встреча '
+    'обновление версия тесты логи метрики нагрузка очередь память диск сеть'
+).split()
+
+# Размер сообщения в словах: (мин, макс)
+SIZE_CLASSES = {
+    'short': (1, 8),
+    'medium': (9, 40),
+    'long': (41, 200),
+}
+
+def parse_size_mix(value: str) -> Dict[str, float]:
+    """'short=0.6,medium=0.3,long=0.1' → веса классов размера"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in SIZE_CLASSES:
+            raise ValueError(f"Неизвестный класс размера: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+class SyntheticCorpus:
+    """Детерминированный (по seed) генератор сообщений с заданным составом.
+    
+    Частоты слов — по Ципфу, отправители — из фиксированного множества
+    мощностью senders, размеры — по size_mix.
+    """
+    
+    def __init__(
+        self,
+        seed: int = 42,
+        senders: int = 1000,
+        size_mix: Optional[Dict[str, float]] = None,
+        vocabulary: int = 20000,
+        media_ratio: float = 0.1,
+        reply_ratio: float = 0.2
+    ):
+        self.random = random.Random(seed)
+        self.senders = senders
+        self.size_mix = size_mix or {'short': 0.6, 'medium': 0.3, 'long': 0.1}
+        self.media_ratio = media_ratio
+        self.reply_ratio = reply_ratio
+        
+        self.words = list(SEED_WORDS) + [
+            self._pseudo_word() for _ in range(max(0, vocabulary - len(SEED_WORDS)))
+        ]
+        # Вес ранга r ~ 1/r: частые слова в начале списка
+        self._cum_weights = []
+        total = 0.0
+        for rank in range(1, len(self.words) + 1):
+            total += 1 / rank
+            self._cum_weights.append(total)
+    
+    def _pseudo_word(self) -> str:
+        alphabet = string.ascii_lowercase if self.random.random() < 0.5 else 'абвгдеёжзийклмнопрстуфхцчшщыэюя'
+        return ''.join(self.random.choice(alphabet) for _ in range(self.random.randint(3, 12)))
+    
+    def text(self) -> str:
+        size_class = self.random.choices(list(self.size_mix), weights=list(self.size_mix.values()))[0]
+        low, high = SIZE_CLASSES[size_class]
+        return ' '.join(self.random.choices(
+            self.words, cum_weights=self._cum_weights, k=self.random.randint(low, high)
+        ))
+    
+    def query_words(self, count: int) -> List[str]:
+        """Слова для поисковых запросов: половина частых, половина редких"""
+        frequent = self.words[:50]
+        rare = self.words[len(self.words) // 2:]
+        return [
+            self.random.choice(frequent if i % 2 == 0 else rare)
+            for i in range(count)
+        ]
+    
+    def messages(self, count: int, start_id: int = 1, start_date: Optional[datetime] = None) -> List[dict]:
+        """count описаний сообщений с возрастающими id и датами"""
+        start_date = start_date or datetime.now() - timedelta(days=30)
+        step = timedelta(days=30) / max(count, 1)
+        result = []
+        for i in range(count):
+            message_id = start_id + i
+            reply_to = None
+            if i and self.random.random() < self.reply_ratio:
+                reply_to = self.random.randint(start_id, message_id - 1)
+            result.append({
+                'id': message_id,
+                'text': self.text(),
+                'date': start_date + step * i,
+                'sender_id': self.random.randint(1, self.senders),
+                'reply_to_msg_id': reply_to,
+                'media': 'photo' if self.random.random() < self.media_ratio else None
+            })
+        return result
@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from telethon.tl.types import User, Channel, ChatPhotoEmpty
+
+class FakeMedia:
+    """Заглушка фото/документа: обработчику нужен только id"""
+    
+    def __init__(self, media_id: int):
+        self.id = media_id
+
+class FakeMessage:
+    """Сообщение с теми атрибутами Telethon, которые читают MessageHandler и HistoryScanner"""
+    
+    def __init__(self, data: dict, sender: Optional[User]):
+        self.id = data['id']
+        self.text = data['text']
+        self.date = data['date'].replace(tzinfo=timezone.utc) if data['date'].tzinfo is None else data['date']
+        self.sender_id = data['sender_id']
+        self.sender = sender
+        self.reply_to_msg_id = data['reply_to_msg_id']
+        self.edit_date = None
+        self.photo = FakeMedia(data['id']) if data['media'] == 'photo' else None
+        self.video = None
+        self.document = None
+        self.audio = None
+        self.voice = None
+    
+    async def get_sender(self):
+        return self.sender
+
+class FakeNewMessageEvent:
+    """Аналог events.NewMessage.Event"""
+    
+    def __init__(self, message: FakeMessage, chat: Channel):
+        self.message = message
+        self.chat = chat
+        self.chat_id = chat.id
+        self.sender = message.sender
+        self.sender_id = message.sender_id
+    
+    async def get_chat(self):
+        return self.chat
+    
+    async def get_sender(self):
+        return self.sender
+
+class FakeTelegramClient:
+    """Замена TelegramClient: синтетические чаты, история и поток апдейтов.
+    
+    latency — искусственная задержка каждого «сетевого» вызова, секунды.
+    """
+    
+    def __init__(self, senders: int, latency: float = 0.0):
+        self.latency = latency
+        self.users: Dict[int, User] = {
+            user_id: User(id=user_id, first_name=f'User{user_id}', username=f'user{user_id}', bot=False)
+            for user_id in range(1, senders + 1)
+        }
+        self.chats: Dict[int, Channel] = {}
+        self.histories: Dict[int, List[FakeMessage]] = {}
+        self._handlers = []
+        self.api_calls = 0
+    
+    def add_chat(self, chat_id: int, title: str, history: Optional[List[dict]] = None) -> Channel:
+        chat = Channel(
+            id=chat_id, title=title, photo=ChatPhotoEmpty(),
+            date=datetime.now(timezone.utc), megagroup=True
+        )
+        self.chats[chat_id] = chat
+        self.histories[chat_id] = [self.build_message(data) for data in history or []]
+        return chat
+    
+    def build_message(self, data: dict) -> FakeMessage:
+        return FakeMessage(data, self.users.get(data['sender_id']))
+    
+    def build_event(self, chat_id: int, data: dict) -> FakeNewMessageEvent:
+        return FakeNewMessageEvent(self.build_message(data), self.chats[chat_id])
+    
+    # === API, которым пользуется бот ===
+    
+    def on(self, event_builder):
+        def decorator(handler):
+            self._handlers.append(handler)
+            return handler
+        return decorator
+    
+    async def emit(self, event: FakeNewMessageEvent):
+        """Доставить апдейт всем обработчикам, как это делает Telethon"""
+        for handler in self._handlers:
+            await handler(event)
+    
+    async def _network(self):
+        self.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+    
+    async def get_entity(self, peer):
+        await self._network()
+        if isinstance(peer, list):
+            return [self._lookup(item) for item in peer]
+        entity = self._lookup(peer)
+        if entity is None:
+            raise ValueError(f"Could not find the input entity for {peer}")
+        return entity
+    
+    def _lookup(self, peer_id: int):
+        return self.users.get(peer_id) or self.chats.get(peer_id)
+    
+    async def iter_messages(
+        self,
+        entity,
+        limit: Optional[int] = None,
+        min_id: int = 0,
+        offset_id: int = 0,
+        reverse: bool = False,
+        page_size: int = 100
+    ):
+        """Семантика Telethon: по умолчанию от новых к старым, reverse — от старых к новым"""
+        history = self.histories.get(entity.id, [])
+        selected = [
+            message for message in history
+            if message.id > min_id and (
+                not offset_id or (message.id > offset_id if reverse else message.id < offset_id)
+            )
+        ]
+        selected.sort(key=lambda message: message.id, reverse=not reverse)
+        if limit:
+            selected = selected[:limit]
+        for i, message in enumerate(selected):
+            if i % page_size == 0:
+                await self._network()
+            yield message
@@ -0,0 +1,284 @@
+"""Бенчмарк пропускной способности без живого Telegram.
+
+    python -m benchmarks.run --messages 20000 --output bench.json
+    python -m benchmarks.run --database-url postgresql+asyncpg://.../bench --reset-database
+
+Отчёт — JSON: сообщений/сек, p50/p99 задержки и пиковый RSS по каждому сценарию.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from benchmarks.corpus import SyntheticCorpus, parse_size_mix
+
+SCENARIOS = ('live_ingest', 'history_scan', 'search', 'analytics', 'embeddings')
+LIVE_CHAT_ID = 1000000001
+HISTORY_CHAT_ID = 1000000002
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (q от 0 до 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса (ru_maxrss: КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def summarize(count: int, elapsed: float, latencies: List[float], **extra) -> Dict:
+    return {
+        'operations': count,
+        'seconds': round(elapsed, 4),
+        'per_second': round(count / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        **extra
+    }
+
+async def bench_live_ingest(client, corpus: SyntheticCorpus, args) -> Dict:
+    """Поток events.NewMessage через MessageHandler → IngestQueue → БД"""
+    from database.connection import async_session
+    from core.ingest_queue import IngestQueue
+    from core.entity_cache import EntityCache
+    from core.message_handler import MessageHandler
+    
+    client.add_chat(LIVE_CHAT_ID, 'Benchmark live chat')
+    events = [client.build_event(LIVE_CHAT_ID, data) for data in corpus.messages(args.messages)]
+    
+    queue = IngestQueue(async_session)
+    handler = MessageHandler(
+        client, async_session, ingest_queue=queue, entity_cache=EntityCache(client, async_session)
+    )
+    queue.start()
+    await handler.start_listening()
+    
+    latencies = []
+    interval = 1 / args.rate if args.rate else 0
+    started = time.perf_counter()
+    for i, event in enumerate(events):
+        if interval:
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        event_started = time.perf_counter()
+        await client.emit(event)
+        latencies.append(time.perf_counter() - event_started)
+    # Время до полной записи на диск, а не только до постановки в очередь
+    await queue.stop()
+    elapsed = time.perf_counter() - started
+    
+    return summarize(len(events), elapsed, latencies, latency='handler, per update')
+
+async def bench_history_scan(client, corpus: SyntheticCorpus, args) -> Dict:
+    """HistoryScanner по синтетической истории через iter_messages"""
+    from database.connection import async_session
+    from database.repositories.message_repo import MessageRepository
+    from database.repositories.group_repo import GroupRepository
+    from core.entity_cache import EntityCache
+    from core.history_scanner import HistoryScanner
+    
+    client.add_chat(HISTORY_CHAT_ID, 'Benchmark history chat', corpus.messages(args.history))
+    
+    async with async_session() as session:
+        scanner = HistoryScanner(
+            client, MessageRepository(session), GroupRepository(session),
+            entity_cache=EntityCache(client, async_session)
+        )
+        # Задержка записи каждой страницы (пачки SCAN_BATCH_SIZE)
+        latencies = []
+        save_page = scanner._save_page
+        
+        async def timed_save_page(*page_args):
+            page_started = time.perf_counter()
+            result = await save_page(*page_args)
+            latencies.append(time.perf_counter() - page_started)
+            return result
+        scanner._save_page = timed_save_page
+        
+        started = time.perf_counter()
+        count = await scanner.scan_group_history(HISTORY_CHAT_ID) or 0
+        elapsed = time.perf_counter() - started
+    
+    return summarize(count, elapsed, latencies, latency='per saved page', api_calls=client.api_calls)
+
+async def bench_search(client, corpus: SyntheticCorpus, args) -> Dict:
+    """MessageRepository.search_messages: частые и редкие слова"""
+    from database.connection import async_session
+    from database.repositories.message_repo import MessageRepository
+    
+    words = corpus.query_words(args.queries)
+    latencies = []
+    found = 0
+    async with async_session() as session:
+        repo = MessageRepository(session)
+        started = time.perf_counter()
+        for word in words:
+            query_started = time.perf_counter()
+            found += len(await repo.search_messages(text_query=word, limit=50))
+            latencies.append(time.perf_counter() - query_started)
+        elapsed = time.perf_counter() - started
+    
+    return summarize(len(words), elapsed, latencies, latency='per query', rows_returned=found)
+
+async def bench_analytics(client, corpus: SyntheticCorpus, args) -> Dict:
+    """AnalyticsService: статистика, топ пользователей и таймлайн по каждому чату"""
+    from database.connection import async_session
+    from services.analytics_service import AnalyticsService
+    
+    results = {}
+    analytics = AnalyticsService(async_session)
+    calls = {
+        'get_chat_statistics': lambda chat_id: analytics.get_chat_statistics(chat_id),
+        'get_top_users': lambda chat_id: analytics.get_top_users(chat_id, days=30),
+        'get_activity_timeline': lambda chat_id: analytics.get_activity_timeline(chat_id, days=30)
+    }
+    for name, call in calls.items():
+        latencies = []
+        started = time.perf_counter()
+        for i in range(args.queries):
+            call_started = time.perf_counter()
+            await call(LIVE_CHAT_ID if i % 2 == 0 else HISTORY_CHAT_ID)
+            latencies.append(time.perf_counter() - call_started)
+        results[name] = summarize(args.queries, time.perf_counter() - started, latencies)
+    return results
+
+async def bench_embeddings(client, corpus: SyntheticCorpus, args) -> Dict:
+    """ContextualEmbeddings.embed_batch с холодным и тёплым кэшем"""
+    try:
+        from ml.models.embeddings import ContextualEmbeddings
+    except ImportError as e:
+        return {'skipped': f'ML dependencies are not installed: {e}'}
+    from config.settings import SETTINGS
+    
+    texts = [data['text'] for data in corpus.messages(args.embeddings)]
+    embeddings = ContextualEmbeddings(cache_dir=tempfile.mkdtemp(prefix='bench-embeddings-'))
+    results = {}
+    for phase in ('cold', 'warm'):
+        latencies = []
+        started = time.perf_counter()
+        for start in range(0, len(texts), SETTINGS.EMBEDDING_BATCH_SIZE):
+            batch_started = time.perf_counter()
+            await embeddings.embed_batch(texts[start:start + SETTINGS.EMBEDDING_BATCH_SIZE])
+            latencies.append(time.perf_counter() - batch_started)
+        results[phase] = summarize(
+            len(texts), time.perf_counter() - started, latencies, latency='per batch'
+        )
+    return results
+
+BENCHMARKS = {
+    'live_ingest': bench_live_ingest,
+    'history_scan': bench_history_scan,
+    'search': bench_search,
+    'analytics': bench_analytics,
+    'embeddings': bench_embeddings,
+}
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+async def prepare_database(reset: bool):
+    from database.connection import engine, init_db
+    from database.models import Base
+    
+    if reset:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+
+async def run(args) -> Dict:
+    # Сначала — БД для прогона, потом импорт модулей бота (engine создаётся при импорте)
+    os.environ['DATABASE_URL'] = args.database_url
+    from benchmarks.fake_telethon import FakeTelegramClient
+    from database.connection import engine
+    
+    await prepare_database(args.reset_database)
+    corpus = SyntheticCorpus(seed=args.seed, senders=args.senders, size_mix=args.size_mix)
+    client = FakeTelegramClient(senders=args.senders, latency=args.api_latency_ms / 1000)
+    
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': engine.dialect.name,
+            'params': {
+                'messages': args.messages,
+                'history': args.history,
+                'rate': args.rate,
+                'senders': args.senders,
+                'size_mix': args.size_mix,
+                'seed': args.seed,
+                'api_latency_ms': args.api_latency_ms
+            }
+        },
+        'scenarios': {}
+    }
+    for name in args.scenarios:
+        print(f"▶ {name}...", file=sys.stderr)
+        report['scenarios'][name] = await BENCHMARKS[name](client, corpus, args)
+    report['meta']['peak_rss_mb'] = peak_rss_mb()
+    
+    await engine.dispose()
+    return report
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Telegram Logger throughput benchmark')
+    parser.add_argument('--database-url', help='по умолчанию — временный файл SQLite (нужен aiosqlite)')
+    parser.add_argument('--reset-database', action='store_true',
+                        help='удалить и создать таблицы заново (обязательно для не-временной БД)')
+    parser.add_argument('--scenarios', default=','.join(s for s in SCENARIOS if s != 'embeddings'),
+                        help=f'через запятую из: {", ".join(SCENARIOS)}')
+    parser.add_argument('--messages', type=int, default=10000, help='апдейтов в live_ingest')
+    parser.add_argument('--history', type=int, default=20000, help='сообщений в истории для history_scan')
+    parser.add_argument('--rate', type=float, default=0, help='апдейтов в секунду (0 — без ограничения)')
+    parser.add_argument('--senders', type=int, default=1000, help='мощность множества отправителей')
+    parser.add_argument('--size-mix', type=parse_size_mix, default=parse_size_mix('short=0.6,medium=0.3,long=0.1'))
+    parser.add_argument('--queries', type=int, default=200, help='запросов в search и analytics')
+    parser.add_argument('--embeddings', type=int, default=2000, help='текстов в сценарии embeddings')
+    parser.add_argument('--api-latency-ms', type=float, default=0, help='задержка фейкового Telegram API')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='файл отчёта (по умолчанию — stdout)')
+    args = parser.parse_args(argv)
+    
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'неизвестные сценарии: {sorted(unknown)}')
+    if args.database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='bench-db-'), 'bench.db')
+        args.database_url = f'sqlite+aiosqlite:///{path}'
+    elif not args.reset_database:
+        parser.error('для --database-url нужен --reset-database: бенчмарк пишет в таблицы бота')
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Sequence
+from config.settings import SETTINGS
+from database.repositories.enrichment_repo import EnrichmentRepository
+from ml.models.knowledge_graph import extract_entities
+from utils.metrics import ENRICHMENT_QUEUE_DEPTH, ENRICHMENT_DROPPED
+from utils.profiling import traced
+
+_STOP = object()
+
+class EnrichmentPipeline:
+    """Фоновое ML-обогащение уже сохранённых сообщений (интент, сущности, эмбеддинг).
+    
+    Запись сообщений никогда не ждёт ML. Политика при отставании:
+    очередь заполнена меньше чем на degrade_at — выполняются все стадии;
+    больше — эмбеддинги пропускаются, строка помечается degraded;
+    очередь полна — новые id отбрасываются и учитываются в dropped.
+    """
+    
+    def __init__(
+        self,
+        session_factory,
+        intent_classifier=None,
+        embeddings=None,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        degrade_at: Optional[float] = None
+    ):
+        self.session_factory = session_factory
+        self.intent_classifier = intent_classifier
+        self.embeddings = embeddings
+        self.batch_size = batch_size or SETTINGS.ENRICHMENT_BATCH_SIZE
+        self.concurrency = concurrency or SETTINGS.ENRICHMENT_CONCURRENCY
+        self.queue = asyncio.Queue(maxsize=max_size or SETTINGS.ENRICHMENT_QUEUE_SIZE)
+        # Не меньше 1: при нулевом пороге деградировала бы каждая пачка
+        self.degrade_threshold = max(1, int(self.queue.maxsize * (degrade_at or SETTINGS.ENRICHMENT_DEGRADE_AT)))
+        self.logger = logging.getLogger(__name__)
+        self._workers = []
+        
+        self.processed = 0
+        self.degraded = 0
+        self.dropped = 0
+    
+    def start(self):
+        """Запустить воркеры обогащения"""
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        ENRICHMENT_QUEUE_DEPTH.set_function(self.qsize)
+        self.logger.info(
+            f"🧪 Обогащение запущено (workers={self.concurrency}, batch={self.batch_size}, "
+            f"queue={self.queue.maxsize})"
+        )
+    
+    def offer(self, message_ids: Sequence[int]) -> int:
+        """Поставить id в очередь без ожидания; вернуть кол-во принятых"""
+        accepted = 0
+        for message_id in message_ids:
+            try:
+                self.queue.put_nowait(message_id)
+                accepted += 1
+            except asyncio.QueueFull:
+                break
+        dropped = len(message_ids) - accepted
+        if dropped:
+            # Предупреждать при переходе через каждую тысячу, а не на каждое сообщение
+            if self.dropped // 1000 != (self.dropped + dropped) // 1000:
+                self.logger.warning(f"⚠️ Обогащение не успевает: отброшено {self.dropped + dropped} сообщений")
+            self.dropped += dropped
+            ENRICHMENT_DROPPED.inc(dropped)
+        return accepted
+    
+    def qsize(self) -> int:
+        return self.queue.qsize()
+    
+    async def stop(self):
+        """Остановить воркеры; необработанный хвост очереди отбрасывается"""
+        if not self._workers:
+            return
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.dropped += 1
+            ENRICHMENT_DROPPED.inc()
+        for _ in self._workers:
+            await self.queue.put(_STOP)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.logger.info(
+            f"🧪 Обогащение остановлено (обработано {self.processed}, "
+            f"деградировано {self.degraded}, отброшено {self.dropped})"
+        )
+    
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            
+            # Забрать то, что уже накопилось, не дожидаясь новых id
+            batch = [item]
+            stopping = False
+            while len(batch) < self.batch_size and not self.queue.empty():
+                item = self.queue.get_nowait()
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            try:
+                await self._process(batch)
+            except Exception as e:
+                self.logger.error(f"❌ Ошибка обогащения пачки ({len(batch)}): {e}")
+            if stopping:
+                return
+    
+    @traced()
+    async def _process(self, message_ids: List[int]):
+        degraded = self.queue.qsize() >= self.degrade_threshold
+        
+        async with self.session_factory() as session:
+            repo = EnrichmentRepository(session)
+            rows = await repo.get_messages(message_ids)
+            now = datetime.now()
+            results = [{
+                'message_id': row.id,
+                'telegram_chat_id': row.telegram_chat_id,
+                'intent': None,
+                'intent_confidence': None,
+                'entities': extract_entities(row.text) if row.text else [],
+                'has_embedding': False,
+                'degraded': degraded,
+                'enriched_at': now
+            } for row in rows]
+            
+            with_text = [(result, row.text) for result, row in zip(results, rows) if row.text]
+            texts = [text for _, text in with_text]
+            if texts and self.intent_classifier:
+                intents = await self.intent_classifier.classify_batch(texts)
+                for (result, _), intent in zip(with_text, intents):
+                    result['intent'] = intent['intent']
+                    result['intent_confidence'] = intent['confidence']
+            
+            # Самая дорогая стадия — первой уступает при отставании
+            if texts and self.embeddings and not degraded:
+                await self.embeddings.embed_batch(texts)
+                for result, _ in with_text:
+                    result['has_embedding'] = True
+            
+            await repo.upsert_enrichments(results)
+        
+        self.processed += len(results)
+        if degraded:
+            self.degraded += len(results)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+from telethon import errors, utils
+from telethon.tl.types import User as TelegramUser, Channel
+from config.settings import SETTINGS
+from database.connection import async_session
+from database.repositories.user_repo import UserRepository
+from database.repositories.group_repo import GroupRepository
+
+class EntityCache:
+    """Общий LRU-кэш отправителей и чатов с TTL (ключ — peer id)"""
+    
+    def __init__(
+        self,
+        client,
+        session_factory=None,
+        max_size: Optional[int] = None,
+        ttl: Optional[int] = None,
+        persist: bool = True
+    ):
+        self.client = client
+        self.session_factory = session_factory or async_session
+        self.max_size = max_size or SETTINGS.ENTITY_CACHE_SIZE
+        self.ttl = ttl or SETTINGS.ENTITY_CACHE_TTL
+        self.persist = persist
+        self.logger = logging.getLogger(__name__)
+        self._entries = OrderedDict()  # peer_id -> (expires_at, entity)
+        self._lock = asyncio.Lock()
+    
+    async def resolve(self, peer_id: Optional[int], entity=None):
+        """Получить сущность; уже полученную от Telegram просто запомнить"""
+        if peer_id is None:
+            return None
+        if entity is not None:
+            await self.put([entity])
+            return entity
+        return (await self.get_many([peer_id])).get(peer_id)
+    
+    async def put(self, entities: Iterable):
+        """Положить сущности в кэш; впервые увиденные сохранить в БД"""
+        new_entities = []
+        for entity in entities:
+            peer_id = utils.get_peer_id(entity)
+            if self._lookup(peer_id) is None:
+                new_entities.append(entity)
+            self._store(peer_id, entity)
+        await self._persist(new_entities)
+    
+    async def get_many(self, peer_ids: Iterable[int]) -> Dict[int, object]:
+        """Получить сущности; все промахи запрашиваются одним вызовом"""
+        found = {}
+        missing = []
+        for peer_id in set(peer_ids):
+            entity = self._lookup(peer_id)
+            if entity is not None:
+                found[peer_id] = entity
+            else:
+                missing.append(peer_id)
+        
+        if missing:
+            async with self._lock:
+                # Пока ждали блокировку, другая задача могла уже загрузить часть
+                missing = [p for p in missing if self._lookup(p) is None]
+                if missing:
+                    fetched = await self._fetch(missing)
+                    await self.put(fetched)
+            for peer_id in set(peer_ids) - found.keys():
+                entity = self._lookup(peer_id)
+                if entity is not None:
+                    found[peer_id] = entity
+        
+        return found
+    
+    def _lookup(self, peer_id: int):
+        entry = self._entries.get(peer_id)
+        if entry is None:
+            return None
+        expires_at, entity = entry
+        if expires_at < time.monotonic():
+            del self._entries[peer_id]
+            return None
+        self._entries.move_to_end(peer_id)
+        return entity
+    
+    def _store(self, peer_id: int, entity):
+        self._entries[peer_id] = (time.monotonic() + self.ttl, entity)
+        self._entries.move_to_end(peer_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    async def _fetch(self, peer_ids: list) -> list:
+        try:
+            # Telethon группирует список в один запрос на каждый тип peer'а
+            return [e for e in await self.client.get_entity(peer_ids) if e is not None]
+        except errors.FloodWaitError:
+            # Ожидание решает вызывающий (повтор группы в сканере); поштучные запросы только усугубят лимит
+            raise
+        except Exception as e:
+            self.logger.warning(f"⚠️ Пакетная загрузка {len(peer_ids)} сущностей не удалась: {e}")
+        
+        entities = []
+        for peer_id in peer_ids:
+            try:
+                entities.append(await self.client.get_entity(peer_id))
+            except errors.FloodWaitError:
+                raise
+            except Exception as e:
+                self.logger.debug(f"Сущность {peer_id} недоступна: {e}")
+        return entities
+    
+    async def _persist(self, entities: list):
+        if not self.persist or not entities:
+            return
+        
+        now = datetime.now()
+        users, groups = [], []
+        for entity in entities:
+            if isinstance(entity, TelegramUser):
+                users.append({
+                    'telegram_user_id': entity.id,
+                    'username': entity.username,
+                    'first_name': entity.first_name,
+                    'last_name': entity.last_name,
+                    'is_bot': bool(entity.bot),
+                    'last_seen_at': now
+                })
+            else:
+                is_channel = isinstance(entity, Channel) and bool(entity.broadcast)
+                groups.append({
+                    'telegram_chat_id': entity.id,
+                    'title': getattr(entity, 'title', None),
+                    'username': getattr(entity, 'username', None),
+                    'is_channel': is_channel,
+                    'is_group': not is_channel,
+                    'members_count': getattr(entity, 'participants_count', None)
+                })
+        
+        try:
+            async with self.session_factory() as session:
+                await UserRepository(session).upsert_users(users)
+                await GroupRepository(session).upsert_groups(groups)
+        except Exception as e:
+            self.logger.error(f"❌ Не удалось сохранить пользователей/группы: {e}")
@@ -1,62 +1,190 @@
 from telethon import errors
 import logging
+from config.settings import SETTINGS
 from database.repositories.message_repo import MessageRepository
+from database.repositories.group_repo import GroupRepository
+from core.entity_cache import EntityCache
+from utils.rate_limiter import TokenBucket
+from utils.metrics import SCAN_MESSAGES, SCAN_MAX_MESSAGE_ID, SCAN_MIN_MESSAGE_ID, SCAN_HISTORY_COMPLETE
+from utils.profiling import traced
 from datetime import datetime
 from typing import Optional
 
+# Сколько сообщений Telethon получает за один запрос GetHistory
+TELEGRAM_PAGE_SIZE = 100
+
 class HistoryScanner:
     """Сканирование исторических сообщений"""
     
-    def __init__(self, client, message_repo: MessageRepository):
+    def __init__(
+        self,
+        client,
+        message_repo: MessageRepository,
+        group_repo: GroupRepository,
+        rate_limiter: Optional[TokenBucket] = None,
+        entity_cache: Optional[EntityCache] = None
+    ):
         self.client = client
         self.message_repo = message_repo
+        self.group_repo = group_repo
+        self.rate_limiter = rate_limiter
+        self.entity_cache = entity_cache
         self.logger = logging.getLogger(__name__)
     
+    @traced()
     async def scan_group_history(
         self,
         group_id: int,
         limit: Optional[int] = None,
         start_date: Optional[datetime] = None
     ):
-        """Сканировать всю историю группы"""
+        """Сканировать историю группы, продолжая с сохранённого чекпоинта.
+        
+        FloodWaitError пробрасывается наверх, чтобы вызывающий мог выждать и повторить.
+        """
         try:
+            await self._throttle()
             entity = await self.client.get_entity(group_id)
             self.logger.info(f"📖 Начало сканирования: {entity.title}")
+            if self.entity_cache:
+                await self.entity_cache.put([entity])
+            
+            group = await self.group_repo.get_group(entity.id)
+            bounds = {
+                'max': group.scan_max_message_id if group else None,
+                'min': group.scan_min_message_id if group else None
+            }
+            history_complete = bool(group and group.history_complete)
             
             messages_count = 0
-            async for message in self.client.iter_messages(entity, limit=limit, reverse=False):
-                if start_date and message.date < start_date:
-                    continue
-                
-                sender = await message.get_sender() if message.sender_id else None
-                
-                message_data = {
-                    'telegram_message_id': message.id,
-                    'telegram_chat_id': entity.id,
-                    'chat_title': getattr(entity, 'title', None),
-                    'telegram_sender_id': sender.id if sender else None,
-                    'sender_username': getattr(sender, 'username', None),
-                    'sender_first_name': getattr(sender, 'first_name', None),
-                    'sender_last_name': getattr(sender, 'last_name', None),
-                    'text': message.text,
-                    'is_edited': message.edit_date is not None,
-                    'media_type': self._detect_media_type(message),
-                    'reply_to_msg_id': message.reply_to_msg_id,
-                    'message_date': message.date,
-                    'received_at': datetime.now()
-                }
-                
-                await self.message_repo.save_or_update_message(message_data)
-                messages_count += 1
-                
-                if messages_count % 100 == 0:
-                    self.logger.info(f"⏳ Обработано: {messages_count}")
+            
+            # 1. Новые сообщения после верхней границы — от старых к новым,
+            #    чтобы чекпоинт сдвигался после каждой страницы
+            if bounds['max']:
+                count, _ = await self._scan_range(
+                    entity, bounds, limit=limit, min_id=bounds['max'], reverse=True
+                )
+                messages_count += count
+            
+            # 2. Догрузка истории вниз от нижней границы
+            remaining = limit - messages_count if limit else None
+            if not history_complete and (remaining is None or remaining > 0):
+                count, exhausted = await self._scan_range(
+                    entity, bounds, limit=remaining, start_date=start_date,
+                    offset_id=bounds['min'] or 0
+                )
+                messages_count += count
+                if exhausted:
+                    await self.group_repo.save_scan_checkpoint(entity.id, history_complete=True)
+                    SCAN_HISTORY_COMPLETE.labels(chat_id=entity.id).set(1)
             
             self.logger.info(f"✅ Готово. Всего: {messages_count}")
             return messages_count
+        except errors.FloodWaitError:
+            raise
         except Exception as e:
             self.logger.error(f"❌ Ошибка: {e}")
     
+    async def _scan_range(
+        self,
+        entity,
+        bounds: dict,
+        limit: Optional[int] = None,
+        start_date: Optional[datetime] = None,
+        **iter_kwargs
+    ):
+        """Просканировать диапазон, сохраняя чекпоинт после каждой страницы.
+        
+        Возвращает (кол-во сообщений, дошли ли до конца диапазона).
+        """
+        messages_count = 0
+        exhausted = True
+        page = []
+        fetched = 0
+        await self._throttle()
+        async for message in self.client.iter_messages(entity, limit=limit, **iter_kwargs):
+            fetched += 1
+            if fetched % TELEGRAM_PAGE_SIZE == 0:
+                # Следующая итерация запросит новую страницу у Telegram
+                await self._throttle()
+            
+            if start_date and message.date < start_date:
+                exhausted = False
+                break
+            
+            page.append(message)
+            
+            if len(page) >= SETTINGS.SCAN_BATCH_SIZE:
+                messages_count += await self._save_page(entity, page, bounds)
+                page = []
+                self.logger.info(f"⏳ Обработано: {messages_count}")
+        
+        messages_count += await self._save_page(entity, page, bounds)
+        if limit and messages_count >= limit:
+            exhausted = False
+        return messages_count, exhausted
+    
+    @traced()
+    async def _save_page(self, entity, page: list, bounds: dict) -> int:
+        """Записать страницу и сдвинуть границы чекпоинта"""
+        if not page:
+            return 0
+        senders = await self._resolve_senders(page)
+        count = await self.message_repo.upsert_messages([
+            self._build_message_data(entity, message, senders.get(message.sender_id))
+            for message in page
+        ])
+        
+        ids = [message.id for message in page]
+        bounds['max'] = max(ids + ([bounds['max']] if bounds['max'] else []))
+        bounds['min'] = min(ids + ([bounds['min']] if bounds['min'] else []))
+        await self.group_repo.save_scan_checkpoint(
+            entity.id,
+            title=getattr(entity, 'title', None),
+            max_message_id=bounds['max'],
+            min_message_id=bounds['min']
+        )
+        SCAN_MESSAGES.labels(chat_id=entity.id).inc(len(page))
+        SCAN_MAX_MESSAGE_ID.labels(chat_id=entity.id).set(bounds['max'])
+        SCAN_MIN_MESSAGE_ID.labels(chat_id=entity.id).set(bounds['min'])
+        return count
+    
+    async def _resolve_senders(self, page: list) -> dict:
+        """Отправители страницы: из ответа Telegram, кэша или одним запросом на промахи"""
+        sender_ids = {message.sender_id for message in page if message.sender_id}
+        if not self.entity_cache:
+            senders = {}
+            for message in page:
+                if message.sender_id and message.sender_id not in senders:
+                    senders[message.sender_id] = await message.get_sender()
+            return senders
+        
+        await self.entity_cache.put(
+            {message.sender_id: message.sender for message in page if message.sender}.values()
+        )
+        return await self.entity_cache.get_many(sender_ids)
+    
+    def _build_message_data(self, entity, message, sender) -> dict:
+        return {
+            'telegram_message_id': message.id,
+            'telegram_chat_id': entity.id,
+            'chat_title': getattr(entity, 'title', None),
+            'telegram_sender_id': sender.id if sender else None,
+            'sender_username': getattr(sender, 'username', None),
+            'sender_first_name': getattr(sender, 'first_name', None),
+            'sender_last_name': getattr(sender, 'last_name', None),
+            'text': message.text,
+            'is_edited': message.edit_date is not None,
+            'media_type': self._detect_media_type(message),
+            'reply_to_msg_id': message.reply_to_msg_id,
+            'message_date': message.date,
+            'received_at': datetime.now()
+        }
+    
+    async def _throttle(self):
+        if self.rate_limiter:
+            await self.rate_limiter.acquire()
+    
     def _detect_media_type(self, message):
         if message.photo: return 'photo'
         elif message.video: return 'video'
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from typing import List, Optional
+from config.settings import SETTINGS
+from database.connection import async_session
+from database.repositories.message_repo import MessageRepository
+from utils.metrics import INGEST_QUEUE_DEPTH, INGEST_BATCH_SIZE
+
+_STOP = object()
+
+class IngestQueue:
+    """Очередь отложенной записи сообщений пачками (write-behind).
+    
+    Несколько писателей работают параллельно, каждая пачка — своя сессия из пула.
+    """
+    
+    def __init__(
+        self,
+        session_factory=None,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        max_latency_ms: Optional[int] = None,
+        writers: Optional[int] = None,
+        enrichment=None
+    ):
+        self.session_factory = session_factory or async_session
+        self.writers = writers or SETTINGS.INGEST_WRITERS
+        # EnrichmentPipeline: получает id новых сообщений после commit, без ожидания
+        self.enrichment = enrichment
+        self.batch_size = batch_size or SETTINGS.INGEST_BATCH_SIZE
+        self.max_latency = (max_latency_ms or SETTINGS.INGEST_MAX_LATENCY_MS) / 1000
+        self.queue = asyncio.Queue(maxsize=max_size or SETTINGS.INGEST_QUEUE_SIZE)
+        self.logger = logging.getLogger(__name__)
+        self._tasks = []
+    
+    def start(self):
+        """Запустить фоновую запись"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.writers)]
+            INGEST_QUEUE_DEPTH.set_function(self.qsize)
+            self.logger.info(
+                f"📥 Очередь записи запущена (writers={self.writers}, batch={self.batch_size}, "
+                f"latency={int(self.max_latency * 1000)}ms)"
+            )
+    
+    async def put(self, message_data: dict):
+        """Поставить сообщение в очередь; ждёт, если очередь заполнена"""
+        await self.queue.put(message_data)
+    
+    def qsize(self) -> int:
+        return self.queue.qsize()
+    
+    async def stop(self, timeout: Optional[float] = None):
+        """Дописать всё, что накопилось, и остановить запись (не дольше timeout секунд)"""
+        if not self._tasks:
+            return
+        timeout = timeout or SETTINGS.INGEST_STOP_TIMEOUT
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.error(f"❌ Очередь записи не дописана за {timeout}s, потеряно: {self.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        for result in await asyncio.gather(*self._tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.logger.error(f"❌ Писатель очереди упал: {result}")
+        self._tasks = []
+        self.logger.info("📥 Очередь записи остановлена")
+    
+    async def _drain(self):
+        # _STOP только живым писателям: упавший свой уже не заберёт, а put в полную очередь повис бы
+        for task in self._tasks:
+            if not task.done():
+                await self.queue.put(_STOP)
+        await asyncio.wait(self._tasks)
+        # Если писатели упали, остаток дописываем сами
+        leftovers = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.batch_size):
+            await self._flush(leftovers[start:start + self.batch_size])
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is _STOP:
+                return
+            
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Например, БД недоступна: пачка потеряна, но писатель продолжает работу
+                self.logger.error(f"❌ Пачка ({len(batch)}) не записана: {e}")
+            if stopping:
+                return
+    
+    async def _flush(self, batch: List[dict]):
+        INGEST_BATCH_SIZE.observe(len(batch))
+        inserted_ids = []
+        async with self.session_factory() as session:
+            message_repo = MessageRepository(session)
+            try:
+                await message_repo.upsert_messages(batch, inserted_ids=inserted_ids)
+                self.logger.debug(f"💾 Сохранено пачкой: {len(batch)}")
+            except Exception as e:
+                self.logger.error(f"❌ Ошибка пакетной записи ({len(batch)}): {e}")
+                await session.rollback()
+                # Пачка откатилась целиком — дописываем по одному, чтобы не терять остальные
+                for message_data in batch:
+                    try:
+                        await message_repo.upsert_messages([message_data], inserted_ids=inserted_ids)
+                    except Exception as e:
+                        await session.rollback()
+                        self.logger.error(
+                            f"❌ Сообщение {message_data.get('telegram_message_id')} не сохранено: {e}"
+                        )
+        
+        if self.enrichment and inserted_ids:
+            self.enrichment.offer(inserted_ids)
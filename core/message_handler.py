@@ -1,14 +1,29 @@
 from telethon import events
 from datetime import datetime
 import logging
+import time
+from typing import Optional
+from database.connection import async_session
 from database.repositories.message_repo import MessageRepository
+from core.ingest_queue import IngestQueue
+from core.entity_cache import EntityCache
+from utils.metrics import STAGE_SECONDS, CHAT_UPDATES
+from utils.profiling import traced
 
 class MessageHandler:
     """Обработчик новых сообщений в реальном времени"""
     
-    def __init__(self, client, message_repo: MessageRepository):
+    def __init__(
+        self,
+        client,
+        session_factory=None,
+        ingest_queue: Optional[IngestQueue] = None,
+        entity_cache: Optional[EntityCache] = None
+    ):
         self.client = client
-        self.message_repo = message_repo
+        self.session_factory = session_factory or async_session
+        self.ingest_queue = ingest_queue
+        self.entity_cache = entity_cache
         self.logger = logging.getLogger(__name__)
     
     async def start_listening(self):
@@ -23,11 +38,21 @@ class MessageHandler:
         
         self.logger.info("🆕 Слушание новых сообщений запущено")
     
+    @traced()
     async def _process_message(self, event):
         """Обработка одного сообщения"""
+        started = time.perf_counter()
         message = event.message
-        chat = await event.get_chat()
-        sender = await event.get_sender() if event.sender_id else None
+        CHAT_UPDATES.labels(chat_id=event.chat_id).inc()
+        if self.entity_cache:
+            # Сущности из апдейта кладём в кэш, за недостающими идём в API только при промахе
+            chat = await self.entity_cache.resolve(event.chat_id, event.chat)
+            sender = await self.entity_cache.resolve(event.sender_id, event.sender)
+        else:
+            chat = await event.get_chat()
+            sender = await event.get_sender() if event.sender_id else None
+        lookup_done = time.perf_counter()
+        STAGE_SECONDS.labels(stage='entity_lookup').observe(lookup_done - started)
         
         message_data = {
             'telegram_message_id': message.id,
@@ -46,8 +71,16 @@ class MessageHandler:
             'received_at': datetime.now()
         }
         
-        await self.message_repo.save_message(message_data)
-        self.logger.debug(f"💾 Сохранено: {message.id}")
+        if self.ingest_queue:
+            await self.ingest_queue.put(message_data)
+            STAGE_SECONDS.labels(stage='enqueue').observe(time.perf_counter() - lookup_done)
+            self.logger.debug(f"📥 В очереди: {message.id}")
+        else:
+            # Без очереди — своя короткая сессия на сообщение
+            async with self.session_factory() as session:
+                await MessageRepository(session).save_message(message_data)
+            self.logger.debug(f"💾 Сохранено: {message.id}")
+        STAGE_SECONDS.labels(stage='process').observe(time.perf_counter() - started)
     
     def _detect_media_type(self, message):
         if message.photo: return 'photo'
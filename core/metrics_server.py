@@ -0,0 +1,65 @@
+from aiohttp import web
+import hmac
+import logging
+from typing import Optional
+from config.settings import SETTINGS
+from utils.metrics import REGISTRY
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LOOPBACK = ('127.0.0.1', '::1')
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в текстовом формате Prometheus"""
+    
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, profiler=None):
+        self.host = host or SETTINGS.HOST
+        self.port = port or SETTINGS.PORT
+        # ProfileCapture: если передан, доступен /debug/profile?seconds=N
+        self.profiler = profiler
+        self.logger = logging.getLogger(__name__)
+        self._runner = None
+    
+    async def start(self):
+        """Начать слушать HOST:PORT"""
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        app.router.add_get('/health', self._health)
+        if self.profiler:
+            app.router.add_get('/debug/profile', self._profile)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.logger.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+    
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.Response(text='ok')
+    
+    def _debug_allowed(self, request: web.Request) -> bool:
+        """Отладочные эндпоинты: по PROFILE_TOKEN, а без него — только с localhost"""
+        token = SETTINGS.PROFILE_TOKEN
+        if not token:
+            return request.remote in LOOPBACK
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+    
+    async def _profile(self, request: web.Request) -> web.Response:
+        """Снять профиль и вернуть путь к файлу, когда он будет готов"""
+        if not self._debug_allowed(request):
+            return web.Response(status=403, text='forbidden')
+        try:
+            seconds = int(request.query.get('seconds', 0))
+        except ValueError:
+            return web.Response(status=400, text='seconds must be an integer')
+        if not 0 <= seconds <= SETTINGS.PROFILE_MAX_SECONDS:
+            return web.Response(status=400, text=f'seconds must be between 1 and {SETTINGS.PROFILE_MAX_SECONDS}')
+        task = self.profiler.trigger(seconds or None)
+        if task is None:
+            return web.Response(status=409, text='profile capture already running')
+        return web.Response(text=await task)
@@ -0,0 +1,85 @@
+import asyncio
+import contextlib
+import logging
+from typing import Dict, Optional
+from telethon import errors
+from config.settings import SETTINGS
+from core.history_scanner import HistoryScanner
+from core.entity_cache import EntityCache
+from core.telethon_client import TelethonClientManager
+from database.connection import async_session
+from database.repositories.message_repo import MessageRepository
+from database.repositories.group_repo import GroupRepository
+from utils.rate_limiter import TokenBucket
+
+class ScanOrchestrator:
+    """Параллельное сканирование истории всех групп с общим лимитом запросов"""
+    
+    def __init__(
+        self,
+        telethon_manager: TelethonClientManager,
+        entity_cache: Optional[EntityCache] = None,
+        concurrency: Optional[int] = None,
+        requests_per_second: Optional[float] = None,
+        max_flood_retries: Optional[int] = None
+    ):
+        self.telethon_manager = telethon_manager
+        self.entity_cache = entity_cache
+        self.concurrency = concurrency or SETTINGS.SCAN_CONCURRENCY
+        self.max_flood_retries = max_flood_retries or SETTINGS.SCAN_FLOOD_MAX_RETRIES
+        self.rate_limiter = TokenBucket(requests_per_second or SETTINGS.SCAN_REQUESTS_PER_SECOND)
+        self.logger = logging.getLogger(__name__)
+    
+    async def scan_all_groups(self, limit: Optional[int] = None) -> Dict[int, Optional[int]]:
+        """Просканировать все группы; вернуть {chat_id: кол-во сообщений или None при ошибке}"""
+        groups = await self.telethon_manager.get_groups_info()
+        self.logger.info(f"📚 Сканирование {len(groups)} групп (параллельно: {self.concurrency})")
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self.scan_group(d.id, limit=limit, semaphore=semaphore) for d in groups)
+        )
+        summary = {d.id: count for d, count in zip(groups, results)}
+        
+        failed = [chat_id for chat_id, count in summary.items() if count is None]
+        self.logger.info(
+            f"✅ Сканирование завершено: {len(groups) - len(failed)} ок, {len(failed)} с ошибками"
+        )
+        return summary
+    
+    async def scan_group(
+        self,
+        group_id: int,
+        limit: Optional[int] = None,
+        semaphore: Optional[asyncio.Semaphore] = None
+    ) -> Optional[int]:
+        """Сканировать одну группу, выжидая FloodWait и продолжая с чекпоинта.
+        
+        На время FloodWait слот semaphore освобождается, а общий лимитер
+        ставится на паузу: ограничение аккаунта касается всех сканов.
+        """
+        for attempt in range(self.max_flood_retries + 1):
+            # Своя сессия на группу: AsyncSession нельзя делить между задачами
+            async with semaphore or contextlib.nullcontext(), async_session() as session:
+                scanner = HistoryScanner(
+                    self.telethon_manager.client,
+                    MessageRepository(session),
+                    GroupRepository(session),
+                    rate_limiter=self.rate_limiter,
+                    entity_cache=self.entity_cache
+                )
+                try:
+                    return await scanner.scan_group_history(group_id, limit=limit)
+                except errors.FloodWaitError as e:
+                    wait_seconds = e.seconds
+                    self.rate_limiter.pause(wait_seconds)
+                    if attempt == self.max_flood_retries:
+                        break
+                    self.logger.warning(
+                        f"⏳ FloodWait {e.seconds}s для {group_id}, "
+                        f"попытка {attempt + 1}/{self.max_flood_retries}"
+                    )
+            await asyncio.sleep(wait_seconds)
+        
+        self.logger.error(f"❌ {group_id}: превышено число повторов после FloodWait")
+        return None
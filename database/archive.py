@@ -0,0 +1,229 @@
+from config.settings import SETTINGS
+from database.models import Message
+from database.partitioning import next_month
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+import os
+import re
+import time
+
+# Архив: <ARCHIVE_DIR>/messages/month=YYYY-MM/<секция>-<первый id>-<последний id>.parquet
+# Имя файла детерминировано: повторное архивирование той же секции
+# (сбой между записью файла и DROP) перезаписывает файл, а не дублирует строки.
+MONTH_DIR_RE = re.compile(r'^month=(\d{4})-(\d{2})$')
+ARCHIVE_COLUMNS = [column.name for column in Message.__table__.columns]
+# Список файлов архива кэшируется: covers() вызывается на каждый поиск с date_from.
+# Запись через этот экземпляр сбрасывает кэш сразу, архивирование в другом процессе — через TTL.
+MONTHS_CACHE_SECONDS = 60
+
+def _pyarrow():
+    """pyarrow — необязательная зависимость (нужна только архиву)"""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Для архива сообщений нужен pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+def archive_schema(pa):
+    """Схема Parquet по колонкам модели Message"""
+    fields = []
+    for column in Message.__table__.columns:
+        python_type = column.type.python_type
+        if python_type is bool:
+            arrow_type = pa.bool_()
+        elif python_type is int:
+            arrow_type = pa.int64()
+        elif python_type is float:
+            arrow_type = pa.float64()
+        elif python_type is datetime:
+            arrow_type = pa.timestamp('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+class MessageArchive:
+    """Холодный архив сообщений: помесячные Parquet-файлы на локальном диске"""
+    
+    def __init__(self, base_dir: Optional[str] = None):
+        self.base_dir = os.path.join(base_dir or SETTINGS.ARCHIVE_DIR, 'messages')
+        self.logger = logging.getLogger(__name__)
+        self._months = None
+        self._months_loaded_at = 0.0
+    
+    def _month_dir(self, month: datetime) -> str:
+        return os.path.join(self.base_dir, f"month={month:%Y-%m}")
+    
+    def months(self) -> Dict[datetime, List[str]]:
+        """{месяц: [файлы]} по данным на диске (кэш на MONTHS_CACHE_SECONDS)"""
+        if self._months is None or time.monotonic() - self._months_loaded_at > MONTHS_CACHE_SECONDS:
+            self._months = self._scan_months()
+            self._months_loaded_at = time.monotonic()
+        return self._months
+    
+    def invalidate(self):
+        """Сбросить кэш списка файлов (после записи в архив)"""
+        self._months = None
+    
+    def _scan_months(self) -> Dict[datetime, List[str]]:
+        result = {}
+        if not os.path.isdir(self.base_dir):
+            return result
+        for entry in sorted(os.listdir(self.base_dir)):
+            match = MONTH_DIR_RE.match(entry)
+            if not match:
+                continue
+            path = os.path.join(self.base_dir, entry)
+            files = sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith('.parquet')
+            )
+            if files:
+                result[datetime(int(match.group(1)), int(match.group(2)), 1)] = files
+        return result
+    
+    def files_for(self, date_from: Optional[datetime], date_to: Optional[datetime]) -> List[str]:
+        """Файлы месяцев, пересекающихся с [date_from, date_to]"""
+        files = []
+        for month, month_files in self.months().items():
+            if date_from is not None and next_month(month) <= date_from.replace(tzinfo=None):
+                continue
+            if date_to is not None and month > date_to.replace(tzinfo=None):
+                continue
+            files.extend(month_files)
+        return files
+    
+    def covers(self, date_from: Optional[datetime], date_to: Optional[datetime] = None) -> bool:
+        """Пересекается ли диапазон дат с архивом"""
+        return bool(self.files_for(date_from, date_to))
+    
+    def open_partition(self, month: datetime, name: str) -> 'PartitionWriter':
+        """Писатель Parquet-файла для строк секции name"""
+        return PartitionWriter(self._month_dir(month), name, on_publish=self.invalidate)
+    
+    def search(
+        self,
+        chat_id: Optional[int] = None,
+        text_query: Optional[str] = None,
+        sender_id: Optional[int] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        limit: int = 100
+    ) -> List[dict]:
+        """Поиск в архиве (блокирующий; вызывать через asyncio.to_thread).
+        
+        Фильтры по чату, отправителю и датам отсекают row group по статистике
+        Parquet; текст ищется по вхождению всех слов без учёта регистра —
+        ранжирования, как у полнотекстового индекса, в архиве нет.
+        """
+        files = self.files_for(date_from, date_to)
+        if not files:
+            return []
+        pa = _pyarrow()
+        ds, pc = pa.dataset, pa.compute
+        
+        conditions = []
+        if chat_id:
+            conditions.append(ds.field('telegram_chat_id') == chat_id)
+        if sender_id:
+            conditions.append(ds.field('telegram_sender_id') == sender_id)
+        if date_from:
+            conditions.append(ds.field('message_date') >= date_from.replace(tzinfo=None))
+        if date_to:
+            conditions.append(ds.field('message_date') <= date_to.replace(tzinfo=None))
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        
+        table = ds.dataset(files, schema=archive_schema(pa), format='parquet').to_table(filter=expression)
+        if text_query:
+            texts = pc.fill_null(table['text'], '')
+            for word in text_query.split():
+                table = table.filter(pc.match_substring(texts, word, ignore_case=True))
+                texts = pc.fill_null(table['text'], '')
+        if table.num_rows == 0:
+            return []
+        indices = pc.sort_indices(
+            table, sort_keys=[('message_date', 'descending'), ('id', 'descending')]
+        )
+        return table.take(indices[:limit]).to_pylist()
+
+class PartitionWriter:
+    """Запись одной секции во временный файл; окончательное имя — только в publish()"""
+    
+    def __init__(self, directory: str, name: str, on_publish=None):
+        self.pa = _pyarrow()
+        self.schema = archive_schema(self.pa)
+        self.directory = directory
+        self.name = name
+        self.tmp_path = os.path.join(directory, f".{name}.parquet.tmp")
+        self.path = None
+        self.rows = 0
+        self._writer = None
+        self._first_id = None
+        self._last_id = None
+        self._on_publish = on_publish
+    
+    def write(self, batch: List[tuple]):
+        """Дописать пачку кортежей в порядке ARCHIVE_COLUMNS (блокирующий вызов)"""
+        if not batch:
+            return
+        if self._writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._writer = self.pa.parquet.ParquetWriter(
+                self.tmp_path, self.schema, compression=SETTINGS.ARCHIVE_COMPRESSION
+            )
+        self._writer.write_table(self.pa.Table.from_pylist(
+            [dict(zip(ARCHIVE_COLUMNS, row)) for row in batch], schema=self.schema
+        ))
+        ids = [row[0] for row in batch]
+        self._first_id = min(ids) if self._first_id is None else min(self._first_id, *ids)
+        self._last_id = max(ids) if self._last_id is None else max(self._last_id, *ids)
+        self.rows += len(batch)
+    
+    def close(self):
+        """Дописать и сбросить на диск временный файл (в архиве он ещё не виден)"""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        with open(self.tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+    
+    def publish(self) -> Optional[str]:
+        """Дать файлу окончательное имя — с этого момента строки видны поиску; None, если строк не было"""
+        if self._writer is not None:
+            self.close()
+        if not os.path.exists(self.tmp_path):
+            return None
+        path = os.path.join(self.directory, f"{self.name}-{self._first_id}-{self._last_id}.parquet")
+        os.replace(self.tmp_path, path)
+        self.path = path
+        if self._on_publish:
+            self._on_publish()
+        return path
+    
+    def abort(self):
+        """Удалить временный и, если он уже опубликован, окончательный файл"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+            self.path = None
+            if self._on_publish:
+                self._on_publish()
+
+_archive = None
+
+def get_archive() -> MessageArchive:
+    """Общий экземпляр архива для ARCHIVE_DIR"""
+    global _archive
+    if _archive is None:
+        _archive = MessageArchive()
+    return _archive
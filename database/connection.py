@@ -1,18 +1,37 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config.settings import SETTINGS
 from database.models import Base
+from database.fulltext import setup_fulltext
+from database.partitioning import setup_partitioning
+from database.migrations import upgrade_schema
+from utils.metrics import DB_POOL_CHECKOUT_SECONDS, DB_POOL_CHECKED_OUT, DB_POOL_SIZE
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул соединений, измеряющий ожидание свободного соединения"""
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
 engine = create_async_engine(
     SETTINGS.DATABASE_URL,
     echo=False,
+    poolclass=InstrumentedPool,
     pool_size=20,
     max_overflow=0,
     pool_pre_ping=True
 )
+DB_POOL_CHECKED_OUT.set_function(lambda: engine.sync_engine.pool.checkedout())
+DB_POOL_SIZE.set_function(lambda: engine.sync_engine.pool.size())
 
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
@@ -21,7 +40,12 @@ async_session = sessionmaker(
 async def init_db():
     """Инициализировать базу данных"""
     async with engine.begin() as conn:
+        # Секционированная messages создаётся до create_all (он её пропустит)
+        await setup_partitioning(conn)
         await conn.run_sync(Base.metadata.create_all)
+        # Новые колонки в таблицах, созданных прежними версиями
+        await upgrade_schema(conn)
+        await setup_fulltext(conn)
     logger.info("✅ База данных инициализирована")
 
 async def get_db_session():
@@ -0,0 +1,115 @@
+from sqlalchemy import text, func, literal_column, desc, table, column, select, bindparam, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+from typing import List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+messages_fts = table('messages_fts', column('rowid'), column('rank'))
+
+# PostgreSQL: генерируемый tsvector (русский + английский) и GIN-индекс
+_POSTGRES_DDL = [
+    """
+    ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('russian', coalesce(text, '')) ||
+        to_tsvector('english', coalesce(text, ''))
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector)",
+]
+
+# SQLite: FTS5 поверх messages (external content) и триггеры синхронизации
+_SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        text, content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+]
+
+async def setup_fulltext(conn):
+    """Создать полнотекстовый индекс сообщений для текущего диалекта"""
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        for ddl in _POSTGRES_DDL:
+            await conn.execute(text(ddl))
+    elif dialect == 'sqlite':
+        existing = await conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'")
+        )
+        is_new = existing.first() is None
+        for ddl in _SQLITE_DDL:
+            await conn.execute(text(ddl))
+        if is_new:
+            # Проиндексировать уже сохранённые сообщения
+            await conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+    else:
+        logger.warning(f"⚠️ Полнотекстовый поиск не поддерживается для {dialect}, используется ILIKE")
+        return
+    logger.info(f"🔎 Полнотекстовый индекс готов ({dialect})")
+
+def _fts5_query(text_query: str) -> str:
+    """Экранировать слова запроса, чтобы спецсимволы не ломали синтаксис FTS5"""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text_query.split()]
+    return ' '.join(terms)
+
+def _ts_query(text_query: str):
+    return func.websearch_to_tsquery('russian', text_query).op('||')(
+        func.websearch_to_tsquery('english', text_query)
+    )
+
+def apply_fulltext_search(query, model, text_query: str, dialect: str, ranked: bool = True):
+    """Добавить к запросу полнотекстовое условие и (если ranked) сортировку по релевантности"""
+    if dialect == 'postgresql':
+        search_vector = literal_column('messages.search_vector')
+        ts_query = _ts_query(text_query)
+        query = query.where(search_vector.op('@@')(ts_query))
+        if ranked:
+            query = query.order_by(desc(func.ts_rank_cd(search_vector, ts_query)))
+        return query
+    if dialect == 'sqlite':
+        query = query.join(messages_fts, messages_fts.c.rowid == model.id).where(
+            literal_column('messages_fts').op('MATCH')(_fts5_query(text_query))
+        )
+        if ranked:
+            query = query.order_by(messages_fts.c.rank)
+        return query
+    return query.where(model.text.ilike(f'%{text_query}%'))
+
+async def rank_texts(session, texts: List[Optional[str]], text_query: str) -> Optional[List[float]]:
+    """Релевантность произвольных текстов тем же ts_rank_cd, что и в поиске (PostgreSQL).
+    
+    Нужна, чтобы строки не из messages (архив) сортировались вместе с живыми
+    по одному ключу; для других диалектов ранжирования нет — None.
+    """
+    if session.bind.dialect.name != 'postgresql':
+        return None
+    if not texts:
+        return []
+    rows = func.unnest(bindparam('texts', texts, type_=ARRAY(Text))).table_valued(
+        't', with_ordinality='n'
+    ).render_derived()
+    vector = func.to_tsvector('russian', func.coalesce(rows.c.t, '')).op('||')(
+        func.to_tsvector('english', func.coalesce(rows.c.t, ''))
+    )
+    query = select(func.ts_rank_cd(vector, _ts_query(text_query))).select_from(rows).order_by(rows.c.n)
+    result = await session.execute(query)
+    return list(result.scalars())
@@ -0,0 +1,89 @@
+from sqlalchemy import inspect, text
+from database.models import Base
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Колонки, добавленные в модели после первого релиза. create_all не меняет уже
+# существующие таблицы, поэтому старые базы догоняются здесь:
+# (таблица, новые колонки, DDL после их добавления, предупреждение)
+_UPGRADES = [
+    (
+        'groups', ('scan_max_message_id', 'scan_min_message_id', 'history_complete'),
+        [],
+        None
+    ),
+    (
+        'statistics', ('telegram_chat_id', 'metric_date'),
+        [
+            # Прежние строки — кэш без chat id, ключу счётчиков они не соответствуют
+            "DELETE FROM statistics WHERE telegram_chat_id IS NULL",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_metric ON statistics (telegram_chat_id, metric_name)",
+        ],
+        "счётчики чатов пусты — выполните python main.py --rebuild-stats"
+    ),
+]
+
+# Ключи и индексы, которых нет у старых баз: (таблица, имя ключа, DDL, предупреждение)
+_KEY_UPGRADES = [
+    (
+        'messages', 'uq_chat_message',
+        [
+            # Прежний save_message мог записать сообщение дважды — оставляем самую новую копию
+            "DELETE FROM messages WHERE EXISTS ("
+            "SELECT 1 FROM messages newer "
+            "WHERE newer.telegram_chat_id = messages.telegram_chat_id "
+            "AND newer.telegram_message_id = messages.telegram_message_id "
+            "AND newer.id > messages.id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_message ON messages (telegram_chat_id, telegram_message_id)",
+            # B-tree по тексту заменён полнотекстовым индексом
+            "DROP INDEX IF EXISTS ix_messages_text",
+        ],
+        None
+    ),
+]
+
+def _existing_keys(sync_conn, table_name: str):
+    inspector = inspect(sync_conn)
+    if not inspector.has_table(table_name):
+        return None
+    return (
+        {index['name'] for index in inspector.get_indexes(table_name)} |
+        {constraint['name'] for constraint in inspector.get_unique_constraints(table_name)}
+    )
+
+def _existing_columns(sync_conn, table_name: str):
+    inspector = inspect(sync_conn)
+    if not inspector.has_table(table_name):
+        return None
+    return {column['name'] for column in inspector.get_columns(table_name)}
+
+async def upgrade_schema(conn):
+    """Добавить в существующие таблицы колонки, ключи и индексы, которых нет у старых баз"""
+    for table_name, columns, statements, warning in _UPGRADES:
+        existing = await conn.run_sync(_existing_columns, table_name)
+        if existing is None:
+            continue
+        missing = [name for name in columns if name not in existing]
+        if not missing:
+            continue
+        
+        table = Base.metadata.tables[table_name]
+        for name in missing:
+            column_type = table.columns[name].type.compile(dialect=conn.dialect)
+            await conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"))
+        for statement in statements:
+            await conn.execute(text(statement))
+        logger.info(f"🔧 {table_name}: добавлены колонки {', '.join(missing)}")
+        if warning:
+            logger.warning(f"⚠️ {table_name}: {warning}")
+    
+    for table_name, key, statements, warning in _KEY_UPGRADES:
+        existing = await conn.run_sync(_existing_keys, table_name)
+        if existing is None or key in existing:
+            continue
+        for statement in statements:
+            await conn.execute(text(statement))
+        logger.info(f"🔧 {table_name}: добавлен ключ {key}")
+        if warning:
+            logger.warning(f"⚠️ {table_name}: {warning}")
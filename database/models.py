@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, Enum, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, JSON, ForeignKey, Index, UniqueConstraint, Enum, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -20,6 +20,11 @@ class Group(Base):
     added_at = Column(DateTime, default=datetime.now)
     last_scanned_at = Column(DateTime)
     
+    # Чекпоинт сканирования истории
+    scan_max_message_id = Column(Integer)
+    scan_min_message_id = Column(Integer)
+    history_complete = Column(Boolean, default=False)
+    
     messages = relationship('Message', back_populates='group')
     statistics = relationship('Statistics', back_populates='group')
     
@@ -69,8 +74,8 @@ class Message(Base):
     sender_first_name = Column(String(255))
     sender_last_name = Column(String(255))
     
-    # Контент сообщения
-    text = Column(Text, index=True)
+    # Контент сообщения (поиск — через полнотекстовый индекс, см. database/fulltext.py)
+    text = Column(Text)
     is_edited = Column(Boolean, default=False)
     
     # Медиа
@@ -89,23 +94,74 @@ class Message(Base):
     sender = relationship('User', back_populates='messages')
     
     __table_args__ = (
+        UniqueConstraint('telegram_chat_id', 'telegram_message_id', name='uq_chat_message'),
         Index('idx_chat_message_date', 'telegram_chat_id', 'message_date'),
         Index('idx_sender_date', 'telegram_sender_id', 'message_date'),
     )
 
 
 class Statistics(Base):
-    """Кэш статистики для быстрого доступа"""
+    """Кэш статистики для быстрого доступа (счётчики обновляются при записи сообщений)"""
     __tablename__ = 'statistics'
     
     id = Column(Integer, primary_key=True)
     group_id = Column(Integer, ForeignKey('groups.id'), index=True)
+    telegram_chat_id = Column(Integer)
     metric_name = Column(String(255))
     metric_value = Column(Integer)
+    metric_date = Column(DateTime)
     calculated_at = Column(DateTime, default=datetime.now)
     
     group = relationship('Group', back_populates='statistics')
     
     __table_args__ = (
+        UniqueConstraint('telegram_chat_id', 'metric_name', name='uq_chat_metric'),
         Index('idx_chat_metric', 'group_id', 'metric_name'),
     )
+
+
+class ChatSender(Base):
+    """Уникальные отправители чата (для счётчика unique_users)"""
+    __tablename__ = 'chat_senders'
+    
+    telegram_chat_id = Column(Integer, primary_key=True)
+    telegram_sender_id = Column(Integer, primary_key=True)
+    first_message_at = Column(DateTime)
+
+
+
+class ActivityRollup(Base):
+    """Предагрегированная активность: (чат, отправитель, час/день) → кол-во сообщений"""
+    __tablename__ = 'activity_rollups'
+    
+    telegram_chat_id = Column(Integer, primary_key=True)
+    granularity = Column(String(8), primary_key=True)  # 'hour' | 'day'
+    bucket_start = Column(DateTime, primary_key=True)
+    telegram_sender_id = Column(Integer, primary_key=True)  # 0 — без отправителя
+    sender_username = Column(String(255))
+    message_count = Column(Integer, default=0)
+    last_message = Column(DateTime)
+    
+    __table_args__ = (
+        Index('idx_rollup_chat_bucket', 'telegram_chat_id', 'granularity', 'bucket_start'),
+    )
+
+
+class MessageEnrichment(Base):
+    """Результаты ML-обогащения сообщения (интент, сущности, эмбеддинг)"""
+    __tablename__ = 'message_enrichments'
+    
+    # Без внешнего ключа: секционированная messages не уникальна по одному id,
+    # а строки обогащения переживают перенос сообщения в архив
+    message_id = Column(Integer, primary_key=True)
+    telegram_chat_id = Column(Integer)
+    intent = Column(String(50), index=True)
+    intent_confidence = Column(Float)
+    entities = Column(JSON)
+    has_embedding = Column(Boolean, default=False)
+    degraded = Column(Boolean, default=False)  # часть стадий пропущена из-за отставания
+    enriched_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index('idx_enrichment_chat_intent', 'telegram_chat_id', 'intent'),
+    )
@@ -0,0 +1,224 @@
+from sqlalchemy import text, Table, Column, MetaData, Index, PrimaryKeyConstraint, UniqueConstraint
+from config.settings import SETTINGS
+from database.models import Message
+from database.fulltext import setup_fulltext
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Секционирование messages по месяцам message_date (только PostgreSQL).
+# Уникальные ключи секционированной таблицы обязаны включать ключ секции:
+# PK — (id, message_date), uq_chat_message — (chat, message_id, message_date).
+# Дата сообщения в Telegram не меняется при редактировании, поэтому
+# ON CONFLICT по расширенному ключу находит ту же строку.
+PARTITION_CONFLICT_KEYS = ('telegram_chat_id', 'telegram_message_id', 'message_date')
+PARTITION_NAME_RE = re.compile(r'^messages_p(\d{4})(\d{2})$')
+
+_partitioned = False
+_known_months = set()
+
+def is_partitioned() -> bool:
+    """messages — секционированная таблица (определяется в setup_partitioning)"""
+    return _partitioned
+
+def month_start(moment: datetime) -> datetime:
+    """Начало месяца (naive UTC, как хранится message_date)"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(month: datetime) -> datetime:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+def partition_month(name: str):
+    """Месяц секции по её имени; None для чужих таблиц"""
+    match = PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+def _partitioned_messages_table() -> Table:
+    """Описание messages для PARTITION BY RANGE (message_date).
+    
+    Колонки и индексы берутся из модели Message. Внешние ключи на groups/users
+    не создаются (связи ORM от них не зависят), одиночные индексы по колонке,
+    которая уже ведёт составной индекс, опускаются — в каждой секции они
+    дублировали бы друг друга.
+    """
+    source = Message.__table__
+    columns = [
+        Column(
+            column.name, column.type,
+            nullable=False if column.name in ('id', 'message_date') else column.nullable,
+            autoincrement=column.name == 'id'
+        )
+        for column in source.columns
+    ]
+    composite = [
+        [column.name for column in index.columns]
+        for index in source.indexes if len(index.columns) > 1
+    ] + [list(PARTITION_CONFLICT_KEYS)]
+    leading = {names[0] for names in composite}
+    indexes = [
+        Index(index.name, *[column.name for column in index.columns])
+        for index in sorted(source.indexes, key=lambda index: index.name)
+        if len(index.columns) > 1 or next(iter(index.columns)).name not in leading
+    ]
+    return Table(
+        source.name, MetaData(), *columns,
+        PrimaryKeyConstraint('id', 'message_date', name='messages_pkey'),
+        UniqueConstraint(*PARTITION_CONFLICT_KEYS, name='uq_chat_message'),
+        *indexes,
+        postgresql_partition_by='RANGE (message_date)'
+    )
+
+async def _detect(conn) -> bool:
+    result = await conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'messages' AND c.relnamespace = to_regnamespace(current_schema())"
+    ))
+    return result.first() is not None
+
+async def setup_partitioning(conn):
+    """Создать секционированную messages до create_all (PostgreSQL, MESSAGE_PARTITIONING).
+    
+    Существующая обычная таблица не трогается — её переводит
+    python main.py --partition-messages.
+    """
+    global _partitioned
+    if conn.dialect.name != 'postgresql':
+        _partitioned = False
+        return
+    exists = (await conn.execute(text("SELECT to_regclass('messages')"))).scalar() is not None
+    if SETTINGS.MESSAGE_PARTITIONING and not exists:
+        table = _partitioned_messages_table()
+        await conn.run_sync(lambda sync_conn: table.create(sync_conn))
+        logger.info("🗂️ Таблица messages создана с помесячным секционированием")
+    _partitioned = await _detect(conn)
+    if SETTINGS.MESSAGE_PARTITIONING and not _partitioned:
+        logger.warning(
+            "⚠️ MESSAGE_PARTITIONING включён, но messages не секционирована: "
+            "выполните python main.py --partition-messages"
+        )
+    if _partitioned:
+        _known_months.clear()
+        _known_months.update(month for month, _ in await list_partitions(conn))
+
+async def list_partitions(conn) -> List[tuple]:
+    """[(месяц, имя секции)] по возрастанию месяца"""
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'messages' AND p.relnamespace = to_regnamespace(current_schema())"
+    ))
+    partitions = [(partition_month(name), name) for name in result.scalars()]
+    return sorted(partition for partition in partitions if partition[0] is not None)
+
+async def lock_partitions(conn):
+    """Advisory-блокировка DDL секций до конца транзакции.
+    
+    Берётся первой, до блокировок messages и её секций: так все, кто меняет
+    набор секций, захватывают блокировки в одном порядке.
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('messages_partitions'))"))
+
+async def _create_partitions(conn, months: Iterable[datetime]):
+    # Сериализуем DDL между процессами: CREATE ... IF NOT EXISTS не защищён от гонки
+    await lock_partitions(conn)
+    for month in months:
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF messages "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+        ))
+
+async def ensure_partitions(session, dates: Iterable[datetime]):
+    """Создать недостающие секции для дат пачки отдельной короткой транзакцией.
+    
+    Отдельная транзакция: откат пачки не должен откатывать DDL, который
+    уже отмечен в кэше известных секций.
+    """
+    if not _partitioned:
+        return
+    missing = sorted({month_start(date) for date in dates if date is not None} - _known_months)
+    if not missing:
+        return
+    async with session.bind.begin() as conn:
+        await _create_partitions(conn, missing)
+    _known_months.update(missing)
+    logger.info(f"🗂️ Созданы секции messages: {', '.join(partition_name(m) for m in missing)}")
+
+def forget_partition(month: datetime):
+    """Секция удалена (архивирована): при новой записи её придётся создать заново"""
+    _known_months.discard(month)
+
+async def migrate_to_partitioned(conn):
+    """Перевести обычную messages в секционированную (копированием, в одной транзакции).
+    
+    Таблица блокируется на всё время копирования — запускать при остановленном боте.
+    """
+    global _partitioned
+    if conn.dialect.name != 'postgresql':
+        logger.warning("⚠️ Секционирование поддерживается только для PostgreSQL")
+        return
+    if await _detect(conn):
+        logger.info("🗂️ messages уже секционирована")
+        _partitioned = True
+        return
+    
+    await lock_partitions(conn)
+    await conn.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+    nulls = (await conn.execute(text("SELECT count(*) FROM messages WHERE message_date IS NULL"))).scalar()
+    if nulls:
+        # Ключ секции не может быть NULL; время получения — ближайшая оценка
+        await conn.execute(text(
+            "UPDATE messages SET message_date = coalesce(received_at, now()) WHERE message_date IS NULL"
+        ))
+        logger.warning(f"⚠️ {nulls} сообщений без message_date: подставлено received_at")
+    
+    # Имена индексов и ограничений уникальны в схеме — освобождаем их до создания новой таблицы
+    await conn.execute(text("ALTER TABLE message_enrichments DROP CONSTRAINT IF EXISTS message_enrichments_message_id_fkey"))
+    await conn.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+    await conn.execute(text("ALTER TABLE messages_unpartitioned DROP CONSTRAINT IF EXISTS uq_chat_message"))
+    await conn.execute(text("ALTER TABLE messages_unpartitioned DROP CONSTRAINT IF EXISTS messages_pkey"))
+    indexes = await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = 'messages_unpartitioned' "
+        "AND schemaname = current_schema()"
+    ))
+    for name in indexes.scalars().all():
+        await conn.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+    
+    table = _partitioned_messages_table()
+    await conn.run_sync(lambda sync_conn: table.create(sync_conn))
+    months = await conn.execute(text(
+        "SELECT DISTINCT date_trunc('month', message_date) FROM messages_unpartitioned"
+    ))
+    await _create_partitions(conn, sorted(months.scalars().all()))
+    
+    copied = [column.name for column in table.columns]
+    await conn.execute(text(
+        f"INSERT INTO messages ({', '.join(copied)}) "
+        f"SELECT {', '.join(copied)} FROM messages_unpartitioned"
+    ))
+    # Новая последовательность id продолжает старую
+    await conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('messages', 'id'), "
+        "coalesce((SELECT max(id) FROM messages), 0) + 1, false)"
+    ))
+    await conn.execute(text("DROP TABLE messages_unpartitioned"))
+    await setup_fulltext(conn)
+    
+    _partitioned = True
+    _known_months.clear()
+    _known_months.update(month for month, _ in await list_partitions(conn))
+    logger.info(f"🗂️ messages секционирована: {len(_known_months)} месяцев")
@@ -0,0 +1,9 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+def dialect_insert(session: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT для текущего диалекта (PostgreSQL/SQLite)"""
+    if session.bind.dialect.name == 'postgresql':
+        return pg_insert(model)
+    return sqlite_insert(model)
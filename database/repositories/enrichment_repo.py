@@ -0,0 +1,60 @@
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Message, MessageEnrichment
+from database.repositories.base import dialect_insert
+from typing import List, Optional, Sequence
+import logging
+
+class EnrichmentRepository:
+    """Результаты ML-обогащения сообщений"""
+    
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.logger = logging.getLogger(__name__)
+    
+    async def get_messages(self, message_ids: Sequence[int]) -> List:
+        """Лёгкие строки сообщений для обогащения (без объектов Message)"""
+        if not message_ids:
+            return []
+        result = await self.session.execute(
+            select(
+                Message.id,
+                Message.telegram_chat_id,
+                Message.telegram_sender_id,
+                Message.reply_to_msg_id,
+                Message.text
+            ).where(Message.id.in_(message_ids))
+        )
+        return result.all()
+    
+    async def upsert_enrichments(self, rows: List[dict]) -> int:
+        """Записать результаты пачкой (INSERT ... ON CONFLICT, один commit)"""
+        if not rows:
+            return 0
+        stmt = dialect_insert(self.session, MessageEnrichment).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['message_id'],
+            set_={
+                column: stmt.excluded[column]
+                for column in rows[0] if column != 'message_id'
+            }
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+        return len(rows)
+    
+    async def get_enrichment(self, message_id: int) -> Optional[MessageEnrichment]:
+        """Результаты обогащения одного сообщения"""
+        result = await self.session.execute(
+            select(MessageEnrichment).where(MessageEnrichment.message_id == message_id)
+        )
+        return result.scalar_one_or_none()
+    
+    async def get_intent_distribution(self, chat_id: int) -> dict:
+        """Кол-во сообщений чата по интентам"""
+        result = await self.session.execute(
+            select(MessageEnrichment.intent, func.count())
+            .where(MessageEnrichment.telegram_chat_id == chat_id, MessageEnrichment.intent.isnot(None))
+            .group_by(MessageEnrichment.intent)
+        )
+        return dict(result.all())
@@ -0,0 +1,61 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Group
+from database.repositories.base import dialect_insert
+from datetime import datetime
+from typing import List, Optional
+import logging
+
+class GroupRepository:
+    """Работа с группами в БД"""
+    
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.logger = logging.getLogger(__name__)
+    
+    async def get_group(self, chat_id: int) -> Optional[Group]:
+        """Получить группу по telegram_chat_id"""
+        result = await self.session.execute(
+            select(Group).where(Group.telegram_chat_id == chat_id)
+        )
+        return result.scalars().first()
+    
+    async def save_scan_checkpoint(
+        self,
+        chat_id: int,
+        title: Optional[str] = None,
+        max_message_id: Optional[int] = None,
+        min_message_id: Optional[int] = None,
+        history_complete: Optional[bool] = None
+    ):
+        """Сохранить чекпоинт сканирования (переданные поля)"""
+        values = {'last_scanned_at': datetime.now()}
+        if title is not None:
+            values['title'] = title
+        if max_message_id is not None:
+            values['scan_max_message_id'] = max_message_id
+        if min_message_id is not None:
+            values['scan_min_message_id'] = min_message_id
+        if history_complete is not None:
+            values['history_complete'] = history_complete
+        
+        stmt = dialect_insert(self.session, Group).values(telegram_chat_id=chat_id, **values)
+        stmt = stmt.on_conflict_do_update(index_elements=['telegram_chat_id'], set_=values)
+        await self.session.execute(stmt)
+        await self.session.commit()
+    
+    async def upsert_groups(self, groups: List[dict]) -> int:
+        """Вставить или обновить метаданные групп (без чекпоинтов сканирования)"""
+        if not groups:
+            return 0
+        stmt = dialect_insert(self.session, Group).values(groups)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['telegram_chat_id'],
+            set_={
+                column: stmt.excluded[column]
+                for column in groups[0] if column != 'telegram_chat_id'
+            }
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+        return len(groups)
@@ -1,25 +1,52 @@
-from sqlalchemy import select, and_, or_, desc, func
+from sqlalchemy import select, and_, or_, desc, func, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.models import Message, User, Group
+from database.repositories.base import dialect_insert
+from database.repositories.stats_repo import StatisticsRepository
+from database.repositories.rollup_repo import RollupRepository
+from database.fulltext import apply_fulltext_search, rank_texts
+from database.archive import get_archive
+from database import partitioning
+from utils.metrics import STAGE_SECONDS
+from utils.profiling import traced
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+import asyncio
+import base64
+import json
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Сколько совпадений из архива ранжировать вместе с живыми при текстовом поиске
+ARCHIVE_RANK_CANDIDATES = 1000
+
+def encode_cursor(message_date: datetime, message_id: int) -> str:
+    """Непрозрачный курсор страницы из (message_date, id)"""
+    payload = json.dumps([message_date.isoformat(), message_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Разобрать курсор; ValueError, если он повреждён"""
+    try:
+        message_date, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(message_date), int(message_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
 class MessageRepository:
     """Работа с сообщениями в БД"""
     
     def __init__(self, session: AsyncSession):
         self.session = session
+        self.stats_repo = StatisticsRepository(session)
+        self.rollup_repo = RollupRepository(session)
         self.logger = logging.getLogger(__name__)
     
     async def save_message(self, message_data: dict):
         """Сохранить новое сообщение"""
-        message = Message(**message_data)
-        self.session.add(message)
-        await self.session.commit()
-        return message
+        return await self.upsert_messages([message_data])
     
     async def save_or_update_message(self, message_data: dict):
         """Сохранить или обновить сообщение"""
@@ -43,24 +70,97 @@ class MessageRepository:
         await self.session.commit()
         return existing_msg
     
-    async def search_messages(
+    @traced()
+    async def upsert_messages(
+        self,
+        messages: List[dict],
+        inserted_ids: Optional[List[int]] = None
+    ) -> int:
+        """Массово вставить или обновить сообщения (INSERT ... ON CONFLICT, один commit).
+        
+        Если передан inserted_ids, в него дописываются id впервые вставленных строк.
+        """
+        if not messages:
+            return 0
+        
+        # Один ключ не может встречаться в одном INSERT дважды — оставляем последний
+        unique = {}
+        for message_data in messages:
+            key = (message_data['telegram_chat_id'], message_data['telegram_message_id'])
+            unique[key] = message_data
+        columns = {column for message_data in unique.values() for column in message_data}
+        # Строки в порядке ключа: параллельные писатели берут блокировки в одном порядке
+        rows = [{column: unique[key].get(column) for column in columns} for key in sorted(unique)]
+        
+        if partitioning.is_partitioned():
+            # Уникальный ключ секционированной таблицы включает message_date
+            conflict_keys = partitioning.PARTITION_CONFLICT_KEYS
+            await partitioning.ensure_partitions(self.session, (row.get('message_date') for row in rows))
+        else:
+            conflict_keys = ('telegram_chat_id', 'telegram_message_id')
+        started = time.perf_counter()
+        
+        # 1. Новые строки: DO NOTHING + RETURNING отдаёт только реально вставленные
+        insert_stmt = dialect_insert(self.session, Message).values(rows)
+        insert_stmt = insert_stmt.on_conflict_do_nothing(
+            index_elements=list(conflict_keys)
+        ).returning(
+            Message.id,
+            Message.telegram_chat_id,
+            Message.telegram_message_id,
+            Message.telegram_sender_id,
+            Message.sender_username,
+            Message.media_type,
+            Message.message_date
+        )
+        inserted = (await self.session.execute(insert_stmt)).all()
+        
+        # 2. Уже существующие: обновить на месте
+        inserted_keys = {(row.telegram_chat_id, row.telegram_message_id) for row in inserted}
+        existing = [
+            row for row in rows
+            if (row['telegram_chat_id'], row['telegram_message_id']) not in inserted_keys
+        ]
+        if existing:
+            stmt = dialect_insert(self.session, Message).values(existing)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(conflict_keys),
+                set_={
+                    column: stmt.excluded[column]
+                    for column in columns if column not in conflict_keys
+                }
+            )
+            await self.session.execute(stmt)
+        
+        # Счётчики и роллапы — в той же транзакции, только по новым сообщениям
+        await self.stats_repo.apply_new_messages(inserted)
+        await self.rollup_repo.apply_new_messages(inserted)
+        written = time.perf_counter()
+        await self.session.commit()
+        STAGE_SECONDS.labels(stage='db_write').observe(written - started)
+        STAGE_SECONDS.labels(stage='commit').observe(time.perf_counter() - written)
+        if inserted_ids is not None:
+            inserted_ids.extend(row.id for row in inserted)
+        return len(rows)
+    
+    def _build_search_query(
         self,
         chat_id: Optional[int] = None,
         text_query: Optional[str] = None,
         sender_id: Optional[int] = None,
         date_from: Optional[datetime] = None,
         date_to: Optional[datetime] = None,
-        limit: int = 100,
-        offset: int = 0
-    ) -> List[Message]:
-        """Поиск сообщений"""
+        ranked: bool = True
+    ):
         query = select(Message)
         conditions = []
         
         if chat_id:
             conditions.append(Message.telegram_chat_id == chat_id)
         if text_query:
-            conditions.append(Message.text.ilike(f'%{text_query}%'))
+            query = apply_fulltext_search(
+                query, Message, text_query, self.session.bind.dialect.name, ranked=ranked
+            )
         if sender_id:
             conditions.append(Message.telegram_sender_id == sender_id)
         if date_from:
@@ -70,42 +170,194 @@ class MessageRepository:
         
         if conditions:
             query = query.where(and_(*conditions))
+        return query
+    
+    @traced()
+    async def search_messages(
+        self,
+        chat_id: Optional[int] = None,
+        text_query: Optional[str] = None,
+        sender_id: Optional[int] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        limit: int = 100,
+        offset: int = 0,
+        include_archive: Optional[bool] = None
+    ) -> List[Message]:
+        """Поиск сообщений (с текстом — по релевантности).
         
-        query = query.order_by(desc(Message.message_date)).limit(limit).offset(offset)
-        result = await self.session.execute(query)
-        return result.scalars().all()
+        Если date_from попадает в архивированные месяцы, результаты из Parquet-архива
+        добавляются автоматически; без date_from архив читается только с include_archive=True.
+        """
+        query = self._build_search_query(chat_id, text_query, sender_id, date_from, date_to)
+        query = query.order_by(desc(Message.message_date))
+        if not await self._archive_requested(date_from, date_to, include_archive):
+            result = await self.session.execute(query.limit(limit).offset(offset))
+            return result.scalars().all()
+        
+        result = await self.session.execute(query.limit(limit + offset))
+        live = list(result.scalars().all())
+        # Архив не ранжирует сам: при текстовом запросе берём больше кандидатов
+        # и сортируем их вместе с живыми по общему ключу релевантности
+        candidates = max(limit + offset, ARCHIVE_RANK_CANDIDATES) if text_query else limit + offset
+        try:
+            archived = await asyncio.to_thread(
+                get_archive().search, chat_id, text_query, sender_id, date_from, date_to, candidates
+            )
+        except RuntimeError as e:
+            self.logger.warning(f"⚠️ Архив недоступен, поиск только по базе: {e}")
+            archived = []
+        merged = live + [Message(**row) for row in archived]
+        
+        ranks = None
+        if text_query:
+            ranks = await rank_texts(self.session, [message.text for message in merged], text_query)
+        if ranks is None:
+            merged.sort(key=lambda message: (message.message_date or datetime.min, message.id), reverse=True)
+        else:
+            order = sorted(
+                range(len(merged)),
+                key=lambda i: (ranks[i], merged[i].message_date or datetime.min, merged[i].id),
+                reverse=True
+            )
+            merged = [merged[i] for i in order]
+        return merged[offset:offset + limit]
     
-    async def get_user_activity(self, chat_id: int, days: int = 7):
-        """Получить активность пользователей"""
-        date_from = datetime.now() - timedelta(days=days)
-        query = select(
-            Message.sender_username,
-            func.count(Message.id).label('message_count'),
-            func.max(Message.message_date).label('last_message')
-        ).where(
-            and_(
-                Message.telegram_chat_id == chat_id,
-                Message.message_date >= date_from
+    async def _archive_requested(
+        self,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime],
+        include_archive: Optional[bool]
+    ) -> bool:
+        if include_archive is not None:
+            return include_archive
+        if date_from is None:
+            return False
+        # Список файлов кэшируется, но при его обновлении читается диск — не в event loop
+        return await asyncio.to_thread(get_archive().covers, date_from, date_to)
+    
+    @traced()
+    async def search_messages_page(
+        self,
+        chat_id: Optional[int] = None,
+        text_query: Optional[str] = None,
+        sender_id: Optional[int] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Message], Optional[str]]:
+        """Постраничный поиск по курсору (от новых к старым).
+        
+        Возвращает (сообщения, курсор следующей страницы или None).
+        Стоимость страницы не зависит от её номера: вместо OFFSET
+        используется условие (message_date, id) < курсора.
+        """
+        query = self._build_search_query(
+            chat_id, text_query, sender_id, date_from, date_to, ranked=False
+        )
+        if cursor:
+            cursor_date, cursor_id = decode_cursor(cursor)
+            query = query.where(
+                tuple_(Message.message_date, Message.id) < tuple_(cursor_date, cursor_id)
             )
-        ).group_by(Message.sender_username).order_by(desc('message_count'))
         
+        query = query.order_by(desc(Message.message_date), desc(Message.id)).limit(limit + 1)
         result = await self.session.execute(query)
-        return result.all()
+        messages = result.scalars().all()
+        
+        if len(messages) <= limit:
+            return messages, None
+        messages = messages[:limit]
+        return messages, encode_cursor(messages[-1].message_date, messages[-1].id)
     
+    async def iter_message_batches(
+        self,
+        chat_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        after_id: Optional[int] = None,
+        columns: Optional[Sequence[str]] = None,
+        batch_size: int = 1000,
+        up_to_id: Optional[int] = None
+    ) -> AsyncIterator[list]:
+        """Потоково читать сообщения пачками по batch_size (в порядке id).
+        
+        Читает серверным курсором, не загружая весь результат в память.
+        С columns отдаёт лёгкие кортежи нужных колонок вместо объектов Message.
+        Сессию на время обхода нельзя использовать для других запросов.
+        """
+        if columns:
+            unknown = [name for name in columns if name not in Message.__table__.columns]
+            if unknown:
+                raise ValueError(f"Неизвестные колонки: {unknown}")
+            query = select(*(Message.__table__.columns[name] for name in columns))
+        else:
+            query = select(Message)
+        
+        conditions = []
+        if chat_id:
+            conditions.append(Message.telegram_chat_id == chat_id)
+        if since:
+            conditions.append(Message.message_date >= since)
+        if until:
+            conditions.append(Message.message_date < until)
+        if after_id:
+            conditions.append(Message.id > after_id)
+        if up_to_id is not None:
+            conditions.append(Message.id <= up_to_id)
+        if conditions:
+            query = query.where(and_(*conditions))
+        
+        query = query.order_by(Message.id).execution_options(yield_per=batch_size)
+        result = await self.session.stream(query)
+        try:
+            async for partition in result.partitions():
+                yield [row[0] for row in partition] if not columns else list(partition)
+        finally:
+            await result.close()
+    
+    async def count_messages_after(self, after_id: int, up_to_id: Optional[int] = None) -> int:
+        """Кол-во сообщений с id больше after_id (и не больше up_to_id) — диапазон по первичному ключу"""
+        query = select(func.count(Message.id)).where(Message.id > after_id)
+        if up_to_id is not None:
+            query = query.where(Message.id <= up_to_id)
+        result = await self.session.execute(query)
+        return result.scalar() or 0
+    
+    async def get_max_message_id(self) -> int:
+        """Наибольший id среди видимых (закоммиченных) сообщений"""
+        result = await self.session.execute(select(func.max(Message.id)))
+        return result.scalar() or 0
+    
+    async def iter_messages(self, **kwargs) -> AsyncIterator:
+        """Потоково читать сообщения по одному (аргументы — как у iter_message_batches)"""
+        async for batch in self.iter_message_batches(**kwargs):
+            for row in batch:
+                yield row
+    
+    @traced()
+    async def get_user_activity(self, chat_id: int, days: int = 7, limit: Optional[int] = None):
+        """Получить активность пользователей (из роллапов: дни, по краю диапазона — часы)"""
+        date_from = datetime.now() - timedelta(days=days)
+        return await self.rollup_repo.get_top_senders(chat_id, date_from, limit=limit)
+    
+    @traced()
+    async def get_activity_timeline(
+        self,
+        chat_id: int,
+        date_from: datetime,
+        granularity: str = 'day'
+    ):
+        """Кол-во сообщений по часам/дням (из роллапов)"""
+        return await self.rollup_repo.get_timeline(chat_id, date_from, granularity)
+    
+    @traced()
     async def get_chat_statistics(self, chat_id: int) -> dict:
-        """Получить статистику по чату"""
-        result = await self.session.execute(
-            select(
-                func.count(Message.id).label('total_messages'),
-                func.count(func.distinct(Message.sender_username)).label('unique_users'),
-                func.min(Message.message_date).label('first_message'),
-                func.max(Message.message_date).label('last_message')
-            ).where(Message.telegram_chat_id == chat_id)
-        )
-        row = result.first()
-        return {
-            'total_messages': row[0] or 0,
-            'unique_users': row[1] or 0,
-            'first_message': row[2],
-            'last_message': row[3]
-        }
+        """Получить статистику по чату (из инкрементальных счётчиков)"""
+        return await self.stats_repo.get_chat_statistics(chat_id)
+    
+    async def rebuild_statistics(self, chat_id: Optional[int] = None) -> int:
+        """Пересчитать счётчики и роллапы активности с нуля"""
+        await self.rollup_repo.rebuild(chat_id)
+        return await self.stats_repo.rebuild(chat_id)
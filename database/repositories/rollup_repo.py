@@ -0,0 +1,195 @@
+from sqlalchemy import select, delete, func, desc, and_, or_, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Message, ActivityRollup
+from database.repositories.base import dialect_insert
+from datetime import datetime, timedelta
+from typing import List, Optional
+import logging
+
+GRANULARITIES = ('hour', 'day')
+NO_SENDER = 0
+REBUILD_CHUNK_SIZE = 500
+# Диапазоны длиннее читаются по дневным бакетам
+DAY_BUCKETS_AFTER = timedelta(days=2)
+
+def truncate_to_bucket(moment: datetime, granularity: str) -> datetime:
+    """Начало часового/дневного бакета"""
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class RollupRepository:
+    """Почасовые и дневные роллапы активности (chat, sender, bucket) → count"""
+    
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.logger = logging.getLogger(__name__)
+    
+    async def apply_new_messages(self, rows: List):
+        """Учесть впервые вставленные сообщения (без commit — в транзакции вызывающего)"""
+        buckets = {}
+        for row in rows:
+            if not row.message_date:
+                continue
+            sender_id = row.telegram_sender_id or NO_SENDER
+            for granularity in GRANULARITIES:
+                key = (
+                    row.telegram_chat_id, granularity,
+                    truncate_to_bucket(row.message_date, granularity), sender_id
+                )
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = {
+                        'telegram_chat_id': key[0],
+                        'granularity': key[1],
+                        'bucket_start': key[2],
+                        'telegram_sender_id': key[3],
+                        'sender_username': row.sender_username,
+                        'message_count': 1,
+                        'last_message': row.message_date
+                    }
+                    continue
+                bucket['message_count'] += 1
+                if row.message_date >= bucket['last_message']:
+                    bucket['last_message'] = row.message_date
+                    bucket['sender_username'] = row.sender_username or bucket['sender_username']
+        
+        if not buckets:
+            return
+        
+        greatest = func.greatest if self.session.bind.dialect.name == 'postgresql' else func.max
+        # В порядке ключа — чтобы параллельные транзакции не взаимоблокировались
+        stmt = dialect_insert(self.session, ActivityRollup).values([buckets[key] for key in sorted(buckets)])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['telegram_chat_id', 'granularity', 'bucket_start', 'telegram_sender_id'],
+            set_={
+                'message_count': ActivityRollup.message_count + stmt.excluded.message_count,
+                'last_message': greatest(ActivityRollup.last_message, stmt.excluded.last_message),
+                'sender_username': func.coalesce(
+                    stmt.excluded.sender_username, ActivityRollup.sender_username
+                )
+            }
+        )
+        await self.session.execute(stmt)
+    
+    async def get_timeline(
+        self,
+        chat_id: int,
+        date_from: datetime,
+        granularity: str = 'day'
+    ) -> List:
+        """Кол-во сообщений по бакетам начиная с date_from"""
+        query = select(
+            ActivityRollup.bucket_start,
+            func.sum(ActivityRollup.message_count).label('message_count')
+        ).where(
+            and_(
+                ActivityRollup.telegram_chat_id == chat_id,
+                ActivityRollup.granularity == granularity,
+                ActivityRollup.bucket_start >= truncate_to_bucket(date_from, granularity)
+            )
+        ).group_by(ActivityRollup.bucket_start).order_by(ActivityRollup.bucket_start)
+        
+        result = await self.session.execute(query)
+        return result.all()
+    
+    async def get_top_senders(
+        self,
+        chat_id: int,
+        date_from: datetime,
+        limit: Optional[int] = None,
+        granularity: Optional[str] = None
+    ) -> List:
+        """Самые активные отправители начиная с date_from (точность — один час).
+        
+        По умолчанию длинный диапазон читается по дням, а почасовые бакеты —
+        только для неполного первого дня; короткий (до DAY_BUCKETS_AFTER) — по часам.
+        """
+        hour_start = truncate_to_bucket(date_from, 'hour')
+        day_edge = truncate_to_bucket(date_from, 'day')
+        if day_edge < hour_start:
+            day_edge += timedelta(days=1)
+        if granularity is None:
+            granularity = 'day' if datetime.now() - date_from > DAY_BUCKETS_AFTER else 'hour'
+        
+        if granularity == 'hour':
+            buckets = and_(
+                ActivityRollup.granularity == 'hour',
+                ActivityRollup.bucket_start >= hour_start
+            )
+        else:
+            buckets = or_(
+                and_(
+                    ActivityRollup.granularity == 'hour',
+                    ActivityRollup.bucket_start >= hour_start,
+                    ActivityRollup.bucket_start < day_edge
+                ),
+                and_(
+                    ActivityRollup.granularity == 'day',
+                    ActivityRollup.bucket_start >= day_edge
+                )
+            )
+        query = select(
+            func.max(ActivityRollup.sender_username).label('sender_username'),
+            func.sum(ActivityRollup.message_count).label('message_count'),
+            func.max(ActivityRollup.last_message).label('last_message')
+        ).where(
+            ActivityRollup.telegram_chat_id == chat_id, buckets
+        ).group_by(ActivityRollup.telegram_sender_id).order_by(desc('message_count'))
+        if limit:
+            query = query.limit(limit)
+        
+        result = await self.session.execute(query)
+        return result.all()
+    
+    async def rebuild(self, chat_id: Optional[int] = None):
+        """Пересчитать роллапы с нуля по таблице messages (без commit)"""
+        rollup_filter = ActivityRollup.telegram_chat_id.isnot(None)
+        messages_filter = Message.telegram_chat_id.isnot(None)
+        if chat_id is not None:
+            rollup_filter = ActivityRollup.telegram_chat_id == chat_id
+            messages_filter = Message.telegram_chat_id == chat_id
+        
+        await self.session.execute(delete(ActivityRollup).where(rollup_filter))
+        
+        is_postgres = self.session.bind.dialect.name == 'postgresql'
+        columns = [
+            'telegram_chat_id', 'granularity', 'bucket_start', 'telegram_sender_id',
+            'sender_username', 'message_count', 'last_message'
+        ]
+        for granularity in GRANULARITIES:
+            if is_postgres:
+                bucket = func.date_trunc(granularity, Message.message_date)
+            else:
+                pattern = '%Y-%m-%d %H:00:00' if granularity == 'hour' else '%Y-%m-%d 00:00:00'
+                bucket = func.strftime(pattern, Message.message_date)
+            sender = func.coalesce(Message.telegram_sender_id, NO_SENDER)
+            query = select(
+                Message.telegram_chat_id,
+                literal(granularity),
+                bucket,
+                sender,
+                func.max(Message.sender_username),
+                func.count(Message.id),
+                func.max(Message.message_date)
+            ).where(messages_filter, Message.message_date.isnot(None)).group_by(
+                Message.telegram_chat_id, bucket, sender
+            )
+            
+            if is_postgres:
+                await self.session.execute(
+                    dialect_insert(self.session, ActivityRollup).from_select(columns, query)
+                )
+                continue
+            
+            # SQLite хранит DateTime строкой: ключ бакета должен пройти через тип колонки,
+            # иначе он не совпадёт с тем, что пишет apply_new_messages
+            rows = []
+            for row in (await self.session.execute(query)).all():
+                values = dict(zip(columns, row))
+                values['bucket_start'] = datetime.fromisoformat(values['bucket_start'])
+                rows.append(values)
+            for start in range(0, len(rows), REBUILD_CHUNK_SIZE):
+                await self.session.execute(
+                    dialect_insert(self.session, ActivityRollup).values(rows[start:start + REBUILD_CHUNK_SIZE])
+                )
@@ -0,0 +1,200 @@
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Message, Statistics, ChatSender
+from database.repositories.base import dialect_insert
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+
+MEDIA_PREFIX = 'media:'
+REBUILD_CHUNK_SIZE = 1000
+
+class StatisticsRepository:
+    """Инкрементальные счётчики по чатам в таблице statistics"""
+    
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.logger = logging.getLogger(__name__)
+    
+    async def apply_new_messages(self, rows: List):
+        """Учесть впервые вставленные сообщения (без commit — в транзакции вызывающего).
+        
+        rows — строки с telegram_chat_id, telegram_sender_id, media_type, message_date.
+        """
+        if not rows:
+            return
+        
+        deltas: Dict[int, dict] = {}
+        senders = {}
+        for row in rows:
+            chat = deltas.setdefault(row.telegram_chat_id, {
+                'counters': {'total_messages': 0},
+                'first_message': None,
+                'last_message': None
+            })
+            chat['counters']['total_messages'] += 1
+            if row.media_type:
+                metric = MEDIA_PREFIX + row.media_type
+                chat['counters'][metric] = chat['counters'].get(metric, 0) + 1
+            if row.message_date:
+                if chat['first_message'] is None or row.message_date < chat['first_message']:
+                    chat['first_message'] = row.message_date
+                if chat['last_message'] is None or row.message_date > chat['last_message']:
+                    chat['last_message'] = row.message_date
+            if row.telegram_sender_id:
+                key = (row.telegram_chat_id, row.telegram_sender_id)
+                known = senders.get(key)
+                if known is None or (
+                    row.message_date and known['first_message_at']
+                    and row.message_date < known['first_message_at']
+                ):
+                    senders[key] = {
+                        'telegram_chat_id': row.telegram_chat_id,
+                        'telegram_sender_id': row.telegram_sender_id,
+                        'first_message_at': row.message_date
+                    }
+        
+        # Новые отправители: ON CONFLICT DO NOTHING возвращает только вставленные строки
+        # Ключи сортируются везде ниже: одинаковый порядок блокировок у параллельных транзакций
+        if senders:
+            stmt = dialect_insert(self.session, ChatSender).values([senders[key] for key in sorted(senders)])
+            stmt = stmt.on_conflict_do_nothing().returning(ChatSender.telegram_chat_id)
+            for (chat_id,) in (await self.session.execute(stmt)).all():
+                counters = deltas[chat_id]['counters']
+                counters['unique_users'] = counters.get('unique_users', 0) + 1
+        
+        now = datetime.now()
+        counter_rows = []
+        date_rows = []
+        for chat_id, chat in sorted(deltas.items()):
+            for metric, value in sorted(chat['counters'].items()):
+                counter_rows.append({
+                    'telegram_chat_id': chat_id, 'metric_name': metric,
+                    'metric_value': value, 'calculated_at': now
+                })
+            for metric in ('first_message', 'last_message'):
+                if chat[metric]:
+                    date_rows.append({
+                        'telegram_chat_id': chat_id, 'metric_name': metric,
+                        'metric_date': chat[metric], 'calculated_at': now
+                    })
+        
+        if counter_rows:
+            stmt = dialect_insert(self.session, Statistics).values(counter_rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['telegram_chat_id', 'metric_name'],
+                set_={
+                    'metric_value': Statistics.metric_value + stmt.excluded.metric_value,
+                    'calculated_at': stmt.excluded.calculated_at
+                }
+            )
+            await self.session.execute(stmt)
+        
+        if date_rows:
+            # first_message — минимум, last_message — максимум из старого и нового
+            is_postgres = self.session.bind.dialect.name == 'postgresql'
+            least = func.least if is_postgres else func.min
+            greatest = func.greatest if is_postgres else func.max
+            for metric, pick in (('first_message', least), ('last_message', greatest)):
+                values = [row for row in date_rows if row['metric_name'] == metric]
+                if not values:
+                    continue
+                stmt = dialect_insert(self.session, Statistics).values(values)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['telegram_chat_id', 'metric_name'],
+                    set_={
+                        'metric_date': pick(Statistics.metric_date, stmt.excluded.metric_date),
+                        'calculated_at': stmt.excluded.calculated_at
+                    }
+                )
+                await self.session.execute(stmt)
+    
+    async def get_chat_statistics(self, chat_id: int) -> dict:
+        """Прочитать счётчики чата (несколько строк, без обхода сообщений)"""
+        result = await self.session.execute(
+            select(Statistics.metric_name, Statistics.metric_value, Statistics.metric_date)
+            .where(Statistics.telegram_chat_id == chat_id)
+        )
+        metrics = {name: (value, date) for name, value, date in result.all()}
+        
+        return {
+            'total_messages': metrics.get('total_messages', (0, None))[0] or 0,
+            'unique_users': metrics.get('unique_users', (0, None))[0] or 0,
+            'first_message': metrics.get('first_message', (None, None))[1],
+            'last_message': metrics.get('last_message', (None, None))[1],
+            'media': {
+                name[len(MEDIA_PREFIX):]: value
+                for name, (value, _) in metrics.items() if name.startswith(MEDIA_PREFIX)
+            }
+        }
+    
+    async def rebuild(self, chat_id: Optional[int] = None) -> int:
+        """Пересчитать счётчики с нуля по таблице messages; вернуть кол-во чатов"""
+        stats_filter = Statistics.telegram_chat_id.isnot(None)
+        senders_filter = ChatSender.telegram_chat_id.isnot(None)
+        messages_filter = Message.telegram_chat_id.isnot(None)
+        if chat_id is not None:
+            stats_filter = Statistics.telegram_chat_id == chat_id
+            senders_filter = ChatSender.telegram_chat_id == chat_id
+            messages_filter = Message.telegram_chat_id == chat_id
+        
+        await self.session.execute(delete(Statistics).where(stats_filter))
+        await self.session.execute(delete(ChatSender).where(senders_filter))
+        
+        await self.session.execute(
+            dialect_insert(self.session, ChatSender).from_select(
+                ['telegram_chat_id', 'telegram_sender_id', 'first_message_at'],
+                select(
+                    Message.telegram_chat_id,
+                    Message.telegram_sender_id,
+                    func.min(Message.message_date)
+                ).where(messages_filter, Message.telegram_sender_id.isnot(None))
+                .group_by(Message.telegram_chat_id, Message.telegram_sender_id)
+            )
+        )
+        
+        now = datetime.now()
+        rows = []
+        totals = await self.session.execute(
+            select(
+                Message.telegram_chat_id,
+                func.count(Message.id),
+                func.count(func.distinct(Message.telegram_sender_id)),
+                func.min(Message.message_date),
+                func.max(Message.message_date)
+            ).where(messages_filter).group_by(Message.telegram_chat_id)
+        )
+        chats = 0
+        for chat, total, unique_users, first_message, last_message in totals.all():
+            chats += 1
+            rows += [
+                {'telegram_chat_id': chat, 'metric_name': 'total_messages', 'metric_value': total},
+                {'telegram_chat_id': chat, 'metric_name': 'unique_users', 'metric_value': unique_users},
+                {'telegram_chat_id': chat, 'metric_name': 'first_message', 'metric_date': first_message},
+                {'telegram_chat_id': chat, 'metric_name': 'last_message', 'metric_date': last_message},
+            ]
+        
+        media = await self.session.execute(
+            select(Message.telegram_chat_id, Message.media_type, func.count(Message.id))
+            .where(messages_filter, Message.media_type.isnot(None))
+            .group_by(Message.telegram_chat_id, Message.media_type)
+        )
+        for chat, media_type, count in media.all():
+            rows.append({
+                'telegram_chat_id': chat,
+                'metric_name': MEDIA_PREFIX + media_type,
+                'metric_value': count
+            })
+        
+        for row in rows:
+            row.setdefault('metric_value', None)
+            row.setdefault('metric_date', None)
+            row['calculated_at'] = now
+        for start in range(0, len(rows), REBUILD_CHUNK_SIZE):
+            await self.session.execute(
+                dialect_insert(self.session, Statistics).values(rows[start:start + REBUILD_CHUNK_SIZE])
+            )
+        await self.session.commit()
+        
+        self.logger.info(f"📊 Статистика пересчитана для {chats} чатов")
+        return chats
@@ -0,0 +1,28 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import User
+from database.repositories.base import dialect_insert
+from typing import List
+import logging
+
+class UserRepository:
+    """Работа с пользователями в БД"""
+    
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self.logger = logging.getLogger(__name__)
+    
+    async def upsert_users(self, users: List[dict]) -> int:
+        """Вставить или обновить пользователей одним INSERT ... ON CONFLICT"""
+        if not users:
+            return 0
+        stmt = dialect_insert(self.session, User).values(users)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['telegram_user_id'],
+            set_={
+                column: stmt.excluded[column]
+                for column in users[0] if column != 'telegram_user_id'
+            }
+        )
+        await self.session.execute(stmt)
+        await self.session.commit()
+        return len(users)
@@ -17,36 +17,48 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from config.settings import SETTINGS
 from utils.logger import setup_logging
+from utils.profiling import ProfileCapture, install_slow_callback_detector
 from core.telethon_client import TelethonClientManager
 from core.message_handler import MessageHandler
-from core.history_scanner import HistoryScanner
+from core.ingest_queue import IngestQueue
+from core.entity_cache import EntityCache
+from core.scan_orchestrator import ScanOrchestrator
 from database.connection import init_db, async_session
-from database.repositories.message_repo import MessageRepository
-
-# ML Components
-from ml.models.embeddings import ContextualEmbeddings
-from ml.models.intent_classifier import IntentClassifier
-from ml.models.knowledge_graph import KnowledgeGraph
-from ml.training.trainer import AutoTrainer
-from ml.generation.response_generator import ResponseGenerator
 
 # Services
 from services.analytics_service import AnalyticsService
 
+# ML компоненты импортируются лениво в TelegramLoggerBot.start_ml(),
+# чтобы узлы без ML не загружали torch и sentence_transformers
+
 logger = logging.getLogger(__name__)
 
+def _load_embeddings():
+    """Импорт и загрузка модели эмбеддингов (выполняется в отдельном потоке)"""
+    from ml.models.embeddings import ContextualEmbeddings
+    return ContextualEmbeddings()
+
 class TelegramLoggerBot:
     """Основной класс бота"""
     
     def __init__(self):
         self.telethon_manager = None
         self.client = None
-        self.message_repo = None
         self.message_handler = None
-        self.history_scanner = None
+        self.ingest_queue = None
+        self.entity_cache = None
+        self.scan_orchestrator = None
         self.auto_trainer = None
+        self.embeddings = None
+        self.intent_classifier = None
+        self.knowledge_graph = None
+        self.semantic_index = None
+        self.enrichment = None
+        self.metrics_server = None
+        self.profiler = None
         self.response_generator = None
         self.analytics_service = None
+        self.background_tasks = []
     
     async def initialize(self):
         """Инициализация всех компонентов"""
@@ -59,55 +71,135 @@ class TelegramLoggerBot:
         logger.info("💾 Инициализация базы данных...")
         await init_db()
         
-        # 2. Открыть сессию
-        async with async_session() as session:
-            self.message_repo = MessageRepository(session)
-            
-            # 3. Инициализировать Telethon
-            logger.info("🚀 Коннектинг к Telegram...")
-            self.telethon_manager = TelethonClientManager()
-            self.client = await self.telethon_manager.init_client()
-            
-            # 4. ML компоненты
-            logger.info("🤖 Инициализация ML модулей...")
-            embeddings = ContextualEmbeddings()
-            intent_classifier = IntentClassifier()
-            knowledge_graph = KnowledgeGraph()
+        # 2. Инициализировать Telethon
+        logger.info("🚀 Коннектинг к Telegram...")
+        self.telethon_manager = TelethonClientManager()
+        self.client = await self.telethon_manager.init_client()
+        
+        # 3. Сервисы и обработчики не держат сессию: каждая единица работы
+        #    (пачка записи, запрос, скан группы) берёт свою из пула
+        self.analytics_service = AnalyticsService(async_session)
+        
+        self.ingest_queue = IngestQueue(async_session)
+        self.entity_cache = EntityCache(self.client, async_session)
+        self.message_handler = MessageHandler(
+            self.client, async_session,
+            ingest_queue=self.ingest_queue,
+            entity_cache=self.entity_cache
+        )
+        
+        self.scan_orchestrator = ScanOrchestrator(
+            self.telethon_manager, entity_cache=self.entity_cache
+        )
+        
+        logger.info("✅ Все компоненты открыты")
+    
+    async def start_ml(self):
+        """Загрузить ML компоненты по флагам SETTINGS (в фоне, после старта записи)"""
+        # Обогащение тоже считает эмбеддинги: без модели has_embedding всегда был бы False
+        needs_embeddings = (
+            SETTINGS.ENABLE_ML_TRAINING or SETTINGS.ENABLE_SEMANTIC_INDEX or SETTINGS.ENABLE_ENRICHMENT
+        )
+        needs_graph = SETTINGS.ENABLE_KNOWLEDGE_GRAPH or SETTINGS.ENABLE_ML_TRAINING
+        if not (needs_embeddings or needs_graph
+                or SETTINGS.ENABLE_INTENT_CLASSIFICATION or SETTINGS.ENABLE_AUTO_RESPONSE):
+            logger.info("🤖 ML отключено — режим только записи сообщений")
+            return
+        
+        logger.info("🤖 Фоновая инициализация ML модулей...")
+        if needs_embeddings:
+            # Загрузка модели блокирует надолго — выносим из event loop
+            try:
+                self.embeddings = await asyncio.to_thread(_load_embeddings)
+            except Exception as e:
+                logger.error(f"❌ Не удалось загрузить модель эмбеддингов: {e}")
+                return
+        if needs_graph:
+            from ml.models.knowledge_graph import KnowledgeGraph
+            self.knowledge_graph = KnowledgeGraph()
+            await asyncio.to_thread(self.knowledge_graph.load_snapshot)
+        if SETTINGS.ENABLE_INTENT_CLASSIFICATION:
+            from ml.models.intent_classifier import IntentClassifier
+            self.intent_classifier = IntentClassifier()
+            await asyncio.to_thread(self.intent_classifier.load)
+        if SETTINGS.ENABLE_AUTO_RESPONSE:
+            from ml.generation.response_generator import ResponseGenerator
             self.response_generator = ResponseGenerator()
-            
-            # 5. Сервисы
-            self.analytics_service = AnalyticsService(self.message_repo)
-            
-            # 6. Обработчики и трейнер
-            self.message_handler = MessageHandler(self.client, self.message_repo)
-            self.history_scanner = HistoryScanner(self.client, self.message_repo)
-            
+        
+        # Обогащать новые сообщения после записи, не задерживая её
+        if SETTINGS.ENABLE_ENRICHMENT:
+            from core.enrichment import EnrichmentPipeline
+            self.enrichment = EnrichmentPipeline(
+                async_session,
+                intent_classifier=self.intent_classifier,
+                embeddings=self.embeddings
+            )
+            self.enrichment.start()
+            self.ingest_queue.enrichment = self.enrichment
+        
+        # Индексировать новые сообщения для семантического поиска
+        if SETTINGS.ENABLE_SEMANTIC_INDEX:
+            from ml.models.vector_index import SemanticIndex
+            self.semantic_index = SemanticIndex(self.embeddings)
+            self.background_tasks.append(asyncio.create_task(
+                self.semantic_index.start_continuous_sync(async_session)
+            ))
+        
+        # Начать непрерывное обучение
+        if SETTINGS.ENABLE_ML_TRAINING:
+            from ml.training.trainer import AutoTrainer
             self.auto_trainer = AutoTrainer(
-                message_repo=self.message_repo,
-                embeddings=embeddings,
-                knowledge_graph=knowledge_graph
+                session_factory=async_session,
+                embeddings=self.embeddings,
+                knowledge_graph=self.knowledge_graph,
+                intent_classifier=self.intent_classifier
             )
-            
-            logger.info("✅ Все компоненты открыты")
+            self.background_tasks.append(asyncio.create_task(
+                self.auto_trainer.start_continuous_training()
+            ))
+        
+        logger.info("✅ ML модули готовы")
     
     async def run(self):
         """Показ бота"""
         
         await self.initialize()
         
+        # Профилирование по требованию и детектор блокировок event loop
+        install_slow_callback_detector()
+        if SETTINGS.ENABLE_PROFILING:
+            self.profiler = ProfileCapture()
+            self.profiler.install_signal_handler()
+        
+        if SETTINGS.ENABLE_METRICS:
+            from core.metrics_server import MetricsServer
+            self.metrics_server = MetricsServer(profiler=self.profiler)
+            await self.metrics_server.start()
+        
         # Запустить слушание сообщений
+        self.ingest_queue.start()
         await self.message_handler.start_listening()
         
-        # Начать непрерывное обучение
-        if SETTINGS.ENABLE_ML_TRAINING:
-            training_task = asyncio.create_task(
-                self.auto_trainer.start_continuous_training(check_interval=3600)
-            )
+        # ML загружается в фоне и не задерживает запись сообщений
+        self.background_tasks.append(asyncio.create_task(self.start_ml()))
         
         # Получить группы
         groups = await self.telethon_manager.get_groups_info()
         logger.info(f"📖 Найдено групп: {len(groups)}")
         
+        # Переносить старые секции messages в архив
+        if SETTINGS.ENABLE_ARCHIVAL:
+            from services.retention_service import RetentionService
+            self.background_tasks.append(
+                asyncio.create_task(RetentionService(async_session).start_periodic())
+            )
+        
+        # Догрузить историю групп в фоне
+        if SETTINGS.ENABLE_HISTORY_SCAN:
+            self.background_tasks.append(
+                asyncio.create_task(self.scan_orchestrator.scan_all_groups())
+            )
+        
         # Основной цикл
         try:
             logger.info("\n" + "="*60)
@@ -121,12 +213,53 @@ class TelegramLoggerBot:
             logger.info("\n⚠️  Бот остановлен")
         
         finally:
+            for task in self.background_tasks:
+                task.cancel()
+            # Дождаться отмены: задача в asyncio.to_thread (например, снапшот тренера) иначе
+            # ещё работает, когда финальный снапшот пишет тот же файл
+            await asyncio.gather(*self.background_tasks, return_exceptions=True)
+            if self.knowledge_graph:
+                self.knowledge_graph.save_snapshot()
             await self.telethon_manager.disconnect()
+            await self.ingest_queue.stop()
+            if self.enrichment:
+                await self.enrichment.stop()
+            if self.embeddings:
+                await asyncio.to_thread(self.embeddings.close)
+            if self.metrics_server:
+                await self.metrics_server.stop()
 
 async def main():
     bot = TelegramLoggerBot()
     await bot.run()
 
+async def rebuild_statistics():
+    """Пересчитать счётчики статистики по всем чатам и выйти"""
+    await init_db()
+    await AnalyticsService(async_session).rebuild_statistics()
+
+async def partition_messages():
+    """Перевести messages в помесячные секции (PostgreSQL) и выйти"""
+    from database.connection import engine
+    from database.partitioning import migrate_to_partitioned
+    await init_db()
+    async with engine.begin() as conn:
+        await migrate_to_partitioned(conn)
+
+async def archive_messages():
+    """Архивировать секции старше MESSAGES_RETENTION_MONTHS и выйти"""
+    from services.retention_service import RetentionService
+    await init_db()
+    paths = await RetentionService(async_session).archive_expired()
+    logger.info(f"🧊 Архивировано секций: {len(paths)}")
+
 if __name__ == '__main__':
     setup_logging()
-    asyncio.run(main())
+    if '--rebuild-stats' in sys.argv:
+        asyncio.run(rebuild_statistics())
+    elif '--partition-messages' in sys.argv:
+        asyncio.run(partition_messages())
+    elif '--archive-messages' in sys.argv:
+        asyncio.run(archive_messages())
+    else:
+        asyncio.run(main())
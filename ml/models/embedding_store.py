@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+
+KEY_SIZE = 16  # байт blake2b-дайджеста текста
+
+def content_hash(text: str) -> bytes:
+    """Ключ кэша — хэш содержимого, а не сам текст"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_SIZE).digest()
+
+class LRUEmbeddingCache:
+    """Ограниченный по размеру LRU-кэш векторов в памяти"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+    
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        vector = self._items.get(key)
+        if vector is not None:
+            self._items.move_to_end(key)
+        return vector
+    
+    def put(self, key: bytes, vector: np.ndarray):
+        self._items[key] = vector
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._items)
+
+class EmbeddingStore:
+    """Дисковое хранилище векторов: memory-mapped матрица float32 + индекс хэш → строка.
+    
+    Векторы хранятся нормированными (единичной длины). Привязано к имени модели: у другой модели — свой каталог.
+    Файлы только дописываются, поэтому после падения читается
+    согласованный префикс из keys.bin и vectors.f32.
+    """
+    
+    def __init__(self, base_dir: str, model_name: str, dim: int):
+        self.dim = dim
+        self.path = os.path.join(base_dir, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(self.path, exist_ok=True)
+        
+        self._keys_path = os.path.join(self.path, 'keys.bin')
+        self._vectors_path = os.path.join(self.path, 'vectors.f32')
+        self._check_meta(model_name)
+        
+        self._index = {}
+        self._load_index()
+        self._keys_file = open(self._keys_path, 'ab')
+        self._vectors_file = open(self._vectors_path, 'ab')
+        self._matrix = None
+        self._mapped_rows = 0
+    
+    def _check_meta(self, model_name: str):
+        meta_path = os.path.join(self.path, 'meta.json')
+        meta = {'model': model_name, 'dim': self.dim, 'dtype': 'float32', 'normalized': True}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = json.load(f)
+            if stored != meta:
+                self.logger.warning(f"⚠️ Кэш эмбеддингов не совпадает с моделью ({stored}), сброс")
+                for path in (self._keys_path, self._vectors_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+    
+    def _load_index(self):
+        keys_size = os.path.getsize(self._keys_path) if os.path.exists(self._keys_path) else 0
+        vectors_size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        rows = min(keys_size // KEY_SIZE, vectors_size // (4 * self.dim))
+        
+        # Отрезать недописанный хвост после аварийного завершения
+        if keys_size != rows * KEY_SIZE:
+            os.truncate(self._keys_path, rows * KEY_SIZE)
+        if vectors_size != rows * 4 * self.dim:
+            os.truncate(self._vectors_path, rows * 4 * self.dim)
+        
+        if rows:
+            with open(self._keys_path, 'rb') as f:
+                data = f.read()
+            for row in range(rows):
+                self._index[data[row * KEY_SIZE:(row + 1) * KEY_SIZE]] = row
+        self.logger.info(f"💽 Кэш эмбеддингов: {len(self._index)} векторов ({self.path})")
+    
+    def __len__(self):
+        return len(self._index)
+    
+    def __contains__(self, key: bytes):
+        return key in self._index
+    
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        row = self._index.get(key)
+        if row is None:
+            return None
+        if row >= self._mapped_rows:
+            self._remap()
+        return np.array(self._matrix[row])
+    
+    def put(self, key: bytes, vector: np.ndarray):
+        if key in self._index:
+            return
+        self._vectors_file.write(np.asarray(vector, dtype=np.float32).reshape(self.dim).tobytes())
+        self._keys_file.write(key)
+        self._index[key] = len(self._index)
+    
+    def flush(self):
+        self._vectors_file.flush()
+        self._keys_file.flush()
+    
+    def _remap(self):
+        self.flush()
+        self._mapped_rows = len(self._index)
+        self._matrix = np.memmap(
+            self._vectors_path, dtype=np.float32, mode='r', shape=(self._mapped_rows, self.dim)
+        )
+    
+    def close(self):
+        self.flush()
+        self._keys_file.close()
+        self._vectors_file.close()
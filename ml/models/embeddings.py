@@ -1,23 +1,153 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Optional
+import asyncio
 import logging
+import time
+from config.settings import SETTINGS
+from ml.models.embedding_store import EmbeddingStore, LRUEmbeddingCache, content_hash
+from utils.metrics import EMBEDDING_BATCH_SECONDS, EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_LOOKUPS
+from utils.profiling import traced
 
 class ContextualEmbeddings:
     """Генерирует векторные представления сообщений"""
     
-    def __init__(self, model_name: str = "distiluse-base-multilingual-cased-v2"):
+    def __init__(
+        self,
+        model_name: str = "distiluse-base-multilingual-cased-v2",
+        cache_size: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        batch_window_ms: Optional[int] = None
+    ):
         self.model = SentenceTransformer(model_name)
         self.logger = logging.getLogger(__name__)
-        self.cache = {}
+        self.batch_size = batch_size or SETTINGS.EMBEDDING_BATCH_SIZE
+        self.cache = LRUEmbeddingCache(cache_size or SETTINGS.EMBEDDING_CACHE_SIZE)
+        self.store = EmbeddingStore(
+            cache_dir or SETTINGS.EMBEDDING_CACHE_DIR,
+            model_name,
+            self.model.get_sentence_embedding_dimension()
+        )
+        
+        # Инференс — в одном отдельном потоке: event loop не блокируется, а модель
+        # не вызывается конкурентно (быстрый токенизатор HF не потокобезопасен,
+        # torch и так распараллеливает encode по ядрам); параллельные запросы
+        # объединяет микробатчинг
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embeddings')
+        self.batch_window = (batch_window_ms or SETTINGS.EMBEDDING_BATCH_WINDOW_MS) / 1000
+        self._pending = []
+        self._flush_timer = None
+        self._flush_tasks = set()
+    
+    def close(self):
+        """Дождаться текущего инференса и сбросить дисковый кэш векторов (блокирующий вызов)"""
+        self.executor.shutdown(wait=True)
+        self.store.close()
     
     async def embed_message(self, text: str) -> np.ndarray:
-        """Онтять embedding для сообщения"""
-        if text in self.cache:
-            return self.cache[text]
-        embedding = self.model.encode(text, convert_to_tensor=False)
-        self.cache[text] = embedding
-        return embedding
+        """Онтять embedding для сообщения (единичной длины).
+        
+        Одновременные вызовы собираются в течение batch_window и кодируются одной пачкой.
+        """
+        cached = self.cache.get(content_hash(text))
+        if cached is not None:
+            return cached
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush_pending()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(self.batch_window, self._flush_pending)
+        return await future
+    
+    def _flush_pending(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._encode_pending(batch))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _encode_pending(self, batch: list):
+        try:
+            vectors = await self.embed_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+    
+    async def _encode(self, texts: List[str]) -> np.ndarray:
+        """Закодировать тексты в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        encoded = await loop.run_in_executor(self.executor, partial(
+            self.model.encode,
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ))
+        EMBEDDING_BATCH_SECONDS.observe(time.perf_counter() - started)
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        return encoded.astype(np.float32)
+    
+    @traced()
+    async def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Матрица (len(texts), dim) нормированных эмбеддингов.
+        
+        Берёт векторы из кэша, а промахи кодирует одним вызовом encode
+        пачками по batch_size в пуле потоков.
+        """
+        keys = [content_hash(text) for text in texts]
+        vectors = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self.cache.get(key)
+            if vector is None:
+                vector = self.store.get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                vectors[key] = vector
+        
+        EMBEDDING_CACHE_LOOKUPS.labels(result='hit').inc(len(vectors))
+        EMBEDDING_CACHE_LOOKUPS.labels(result='miss').inc(len(missing))
+        if missing:
+            encoded = await self._encode(list(missing.values()))
+            for key, vector in zip(missing, encoded):
+                self.store.put(key, vector)
+                vectors[key] = vector
+        
+        for key, vector in vectors.items():
+            self.cache.put(key, vector)
+        
+        if not keys:
+            return np.empty((0, self.store.dim), dtype=np.float32)
+        return np.stack([vectors[key] for key in keys])
+    
+    @staticmethod
+    def top_k_similar(query_vector: np.ndarray, matrix: np.ndarray, top_k: int):
+        """Индексы и оценки top_k строк нормированной матрицы по косинусу (по убыванию)"""
+        scores = matrix @ query_vector
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
     
     async def find_similar_messages(
         self,
@@ -27,18 +157,13 @@ class ContextualEmbeddings:
     ) -> List[Dict]:
         """Найти похожие сообщения"""
         query_embedding = await self.embed_message(query)
-        similarities = []
-        
-        for msg in messages:
-            msg_embedding = await self.embed_message(msg)
-            similarity = np.dot(query_embedding, msg_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(msg_embedding) + 1e-8
-            )
-            similarities.append({'text': msg, 'similarity': float(similarity)})
-        
-        return sorted(similarities, key=lambda x: x['similarity'], reverse=True)[:top_k]
+        matrix = await self.embed_batch(messages)
+        indices, scores = self.top_k_similar(query_embedding, matrix, top_k)
+        return [
+            {'text': messages[i], 'similarity': float(score)}
+            for i, score in zip(indices, scores)
+        ]
     
     async def get_chat_context_vector(self, messages: List[str]) -> np.ndarray:
         """Получить целостный вектор контекста"""
-        embeddings = [await self.embed_message(msg) for msg in messages]
-        return np.mean(embeddings, axis=0)
+        return np.mean(await self.embed_batch(messages), axis=0)
@@ -1,11 +1,47 @@
-import torch
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
+from collections import OrderedDict
+import copy
+from datetime import datetime
 import logging
+import os
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+from config.settings import SETTINGS
+from ml.models.embedding_store import content_hash
+from utils.profiling import traced
+
+# Версия формата файла модели: при изменении признаков старые модели не загружаются
+MODEL_FORMAT_VERSION = 1
+HASH_FEATURES = 2 ** 18
+FEEDBACK_MARKERS = ('спасибо', 'благодарю', 'круто', 'отлично', 'thanks', 'thank you', 'great job')
+GREETING_MARKERS = ('hi', 'дравствуй', 'hello', 'привет', 'добрый день', 'доброе утро')
+
+def weak_label(text: str, is_reply: bool = False) -> str:
+    """Разметка истории правилами — обучающие метки, пока нет ручной разметки"""
+    stripped = text.strip()
+    lowered = stripped.lower()
+    if stripped.startswith('/'):
+        return 'command'
+    if stripped.endswith('?'):
+        return 'question'
+    if lowered.startswith(GREETING_MARKERS):
+        return 'greeting'
+    if any(marker in lowered for marker in FEEDBACK_MARKERS):
+        return 'feedback'
+    if is_reply:
+        return 'discussion'
+    return 'statement'
 
 class IntentClassifier:
-    """Классификация интентов сообщений"""
+    """Классификация интентов сообщений.
     
-    def __init__(self):
+    Хэшированные символьные n-граммы + линейный SGDClassifier: без словаря,
+    векторизация всей пачки одним вызовом, дообучение через partial_fit.
+    """
+    
+    def __init__(self, model_path: Optional[str] = None, cache_size: Optional[int] = None):
         self.logger = logging.getLogger(__name__)
         self.intents = {
             0: 'question',
@@ -15,26 +51,145 @@ class IntentClassifier:
             4: 'greeting',
             5: 'feedback',
         }
+        self.model_path = model_path or SETTINGS.INTENT_MODEL_PATH
+        self.cache_size = cache_size or SETTINGS.INTENT_CACHE_SIZE
+        self.vectorizer = HashingVectorizer(
+            analyzer='char_wb',
+            ngram_range=(2, 4),
+            n_features=HASH_FEATURES,
+            alternate_sign=False,
+            lowercase=True
+        )
+        # (модель, кэш её результатов): обучение в потоке заменяет пару одним
+        # присваиванием, так что classify_batch не видит недообученную модель
+        # и не теряет кэш посреди обхода
+        self._state = (None, OrderedDict())
+        self.revision = 0
+        self.trained_samples = 0
         self.logger.info("🤖 IntentClassifier инициализирован")
     
+    @property
+    def classifier(self) -> Optional[SGDClassifier]:
+        return self._state[0]
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.classifier is not None
+    
     async def classify_intent(self, text: str) -> Dict:
         """Классифицировать интент"""
-        # Простая гевристика для демо
-        if text.strip().endswith('?'):
-            intent = 'question'
-            confidence = 0.95
-        elif text.startswith('/'):
-            intent = 'command'
-            confidence = 0.98
-        elif text.lower().startswith(('hi', 'дравствуй', 'hello', 'привет')):
-            intent = 'greeting'
-            confidence = 0.9
-        else:
-            intent = 'statement'
-            confidence = 0.8
+        return (await self.classify_batch([text]))[0]
+    
+    @traced()
+    async def classify_batch(self, texts: Sequence[str]) -> List[Dict]:
+        """Классифицировать пачку текстов (повторы берутся из кэша)"""
+        classifier, cache = self._state
+        keys = [content_hash(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cache and key not in missing:
+                missing[key] = text
         
-        return {
-            'intent': intent,
-            'confidence': confidence,
-            'all_scores': {k: 0.1 for k in self.intents.values()}
-        }
+        predicted = {}
+        if missing:
+            predicted = dict(zip(missing, self._predict(classifier, list(missing.values()))))
+        
+        # Сначала собираем ответ, потом вытесняем: иначе из кэша может уйти
+        # попадание или только что посчитанный результат этой же пачки
+        results = []
+        for key in keys:
+            if key in predicted:
+                result = predicted[key]
+            else:
+                result = cache[key]
+                cache.move_to_end(key)
+            results.append(result)
+        cache.update(predicted)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return results
+    
+    def _predict(self, classifier: Optional[SGDClassifier], texts: List[str]) -> List[Dict]:
+        if classifier is None:
+            # До первого обучения — правила
+            return [
+                {'intent': intent, 'confidence': 0.5, 'all_scores': {intent: 0.5}}
+                for intent in (weak_label(text) for text in texts)
+            ]
+        
+        probabilities = classifier.predict_proba(self.vectorizer.transform(texts))
+        classes = [str(intent) for intent in classifier.classes_]
+        best = probabilities.argmax(axis=1)
+        return [
+            {
+                'intent': classes[index],
+                'confidence': float(row[index]),
+                'all_scores': dict(zip(classes, row.round(4).tolist()))
+            }
+            for row, index in zip(probabilities, best)
+        ]
+    
+    def fit(self, texts: Sequence[str], labels: Sequence[str]):
+        """Обучить модель заново на размеченных текстах"""
+        if not texts:
+            return
+        classifier = self._fitted(SGDClassifier(loss='log_loss', alpha=1e-5), texts, labels)
+        self._state = (classifier, OrderedDict())
+        self.trained_samples = len(texts)
+        self.revision += 1
+    
+    def partial_fit(self, texts: Sequence[str], labels: Sequence[str]):
+        """Дообучить модель на новой пачке размеченных текстов (копию, затем подмена)"""
+        if not texts:
+            return
+        current = self.classifier
+        classifier = copy.deepcopy(current) if current is not None else SGDClassifier(loss='log_loss', alpha=1e-5)
+        self._state = (self._fitted(classifier, texts, labels), OrderedDict())
+        self.trained_samples += len(texts)
+        self.revision += 1
+    
+    def _fitted(self, classifier: SGDClassifier, texts: Sequence[str], labels: Sequence[str]) -> SGDClassifier:
+        unknown = set(labels) - set(self.intents.values())
+        if unknown:
+            raise ValueError(f"Неизвестные интенты: {sorted(unknown)}")
+        classifier.partial_fit(
+            self.vectorizer.transform(texts),
+            np.asarray(labels),
+            classes=np.asarray(sorted(self.intents.values()))
+        )
+        return classifier
+    
+    def save(self, path: Optional[str] = None):
+        """Сохранить модель (атомарно) с версией формата и ревизией"""
+        if not self.is_trained:
+            return
+        path = path or self.model_path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        joblib.dump({
+            'format_version': MODEL_FORMAT_VERSION,
+            'revision': self.revision,
+            'trained_samples': self.trained_samples,
+            'saved_at': datetime.now().isoformat(),
+            'vectorizer': self.vectorizer.get_params(),
+            'classifier': self.classifier
+        }, tmp_path)
+        os.replace(tmp_path, path)
+        self.logger.info(f"💾 Модель интентов r{self.revision} ({self.trained_samples} примеров) → {path}")
+    
+    def load(self, path: Optional[str] = None) -> bool:
+        """Загрузить модель; False, если файла нет или формат устарел"""
+        path = path or self.model_path
+        if not os.path.exists(path):
+            return False
+        state = joblib.load(path)
+        if state.get('format_version') != MODEL_FORMAT_VERSION \
+                or state.get('vectorizer') != self.vectorizer.get_params():
+            self.logger.warning(f"⚠️ {path}: несовместимая модель интентов, нужно переобучение")
+            return False
+        
+        self._state = (state['classifier'], OrderedDict())
+        self.revision = state['revision']
+        self.trained_samples = state['trained_samples']
+        self.logger.info(f"📂 Модель интентов r{self.revision} загружена ({self.trained_samples} примеров)")
+        return True
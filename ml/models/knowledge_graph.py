@@ -1,54 +1,513 @@
-from typing import Dict, List, Set
+from typing import Dict, Iterable, List, Optional, Tuple
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import heapq
 import logging
 from datetime import datetime
 import json
+import os
+import re
+import struct
+import threading
+import zlib
+from config.settings import SETTINGS
 
-class KnowledgeGraph:
-    """Граф знаний из сообщений"""
+SNAPSHOT_MAGIC = b'KGS1'
+SNAPSHOT_VERSION = 2
+# Сколько отправителей хранить отсортированным массивом, прежде чем перейти на битовую карту
+SMALL_SET_LIMIT = 64
+# Сколько сущностей одного сообщения связывать попарно (защита от n² на длинных текстах)
+MAX_PAIRED_ENTITIES = 16
+# Сколько последних сообщений помнить для связей по веткам ответов
+THREAD_CACHE_SIZE = 20000
+
+URL_RE = re.compile(r'https?://\S+|www\.\S+')
+# Слово начинается с буквы; хэштеги и упоминания сохраняют префикс
+TOKEN_RE = re.compile(r'[#@]?[^\W\d_][\w-]*\w')
+STOPWORDS = frozenset('''
+    this that with from have will would there their they them then than what when where which
+    while about into your yours just like been were also only some more most very much such
+    here does done make made should could other these those because after before being over
+    again still even well really thanks thank please okay yeah
+    этот этого этой этом эти этих тоже также только когда тогда потом чтобы если было была были
+    будет будут есть нету меня тебя себя него нему неё нее ними могу может можно нужно надо
+    очень просто сейчас уже ещё еще всех всем весь вся всё все кто что как где так там тут
+    какой какая какие который которая которые после перед через между почему потому
+    спасибо пожалуйста привет вообще вроде типа короче ладно хорошо конечно сегодня завтра
+'''.split())
+
+def extract_entities(text: str) -> List[str]:
+    """Токены без ссылок, стоп-слов и коротких слов (в нижнем регистре)"""
+    return [
+        token for token in TOKEN_RE.findall(URL_RE.sub(' ', text.lower()))
+        if len(token.lstrip('#@')) > 3 and token not in STOPWORDS
+    ]
+
+class SenderSet:
+    """Компактное множество плотных индексов отправителей.
+    
+    Представление выбирается по плотности: отсортированный array('I') (4 байта
+    на элемент) или битовая карта в int (1 бит на индекс до наибольшего).
+    Карта включается, только когда она меньше массива, и отключается обратно,
+    если редкий большой индекс раздул её вдвое против массива.
+    """
+    __slots__ = ('_small', '_bits', '_count')
     
     def __init__(self):
+        self._small = array('I')
+        self._bits = None
+        self._count = 0
+    
+    def add(self, index: int):
+        if self._bits is not None:
+            mask = 1 << index
+            if self._bits & mask:
+                return
+            self._bits |= mask
+            self._count += 1
+            if self._bits.bit_length() > self._count * 64:
+                self._to_array()
+            return
+        position = bisect_left(self._small, index)
+        if position < len(self._small) and self._small[position] == index:
+            return
+        self._small.insert(position, index)
+        if len(self._small) > SMALL_SET_LIMIT and self._small[-1] < len(self._small) * 32:
+            self._to_bitmap()
+    
+    def _to_bitmap(self):
+        bits = 0
+        for item in self._small:
+            bits |= 1 << item
+        self._bits, self._count, self._small = bits, len(self._small), None
+    
+    def _to_array(self):
+        self._small, self._bits = array('I', iter(self)), None
+    
+    def __iter__(self):
+        if self._bits is None:
+            return iter(self._small)
+        return self._iter_bits(self._bits)
+    
+    @staticmethod
+    def _iter_bits(bits: int):
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+    
+    def __contains__(self, index: int) -> bool:
+        if self._bits is not None:
+            return bool(self._bits >> index & 1)
+        position = bisect_left(self._small, index)
+        return position < len(self._small) and self._small[position] == index
+    
+    def __len__(self) -> int:
+        if self._bits is not None:
+            return self._count
+        return len(self._small)
+    
+    def remap(self, mapping: Dict[int, int]) -> 'SenderSet':
+        """Новое множество с переименованными индексами (отсутствующие в mapping выбывают)"""
+        item = SenderSet()
+        item._small = array('I', sorted(mapping[index] for index in self if index in mapping))
+        if len(item._small) > SMALL_SET_LIMIT and item._small[-1] < len(item._small) * 32:
+            item._to_bitmap()
+        return item
+    
+    def to_bytes(self) -> bytes:
+        if self._bits is not None:
+            payload = self._bits.to_bytes((self._bits.bit_length() + 7) // 8, 'little')
+            return struct.pack('<BI', 1, len(payload)) + payload
+        payload = self._small.tobytes()
+        return struct.pack('<BI', 0, len(payload)) + payload
+    
+    @classmethod
+    def from_bytes(cls, data: memoryview, offset: int):
+        """Прочитать множество из снапшота; вернуть (множество, новое смещение)"""
+        kind, length = struct.unpack_from('<BI', data, offset)
+        offset += 5
+        payload = bytes(data[offset:offset + length])
+        item = cls()
+        if kind == 1:
+            item._bits = int.from_bytes(payload, 'little')
+            item._count = bin(item._bits).count('1')
+            item._small = None
+            if item._bits.bit_length() > item._count * 64:
+                item._to_array()
+        else:
+            item._small.frombytes(payload)
+        return item, offset + length
+
+class SpaceSaving:
+    """Top-k «тяжёлых» ключей потока (алгоритм Space-Saving) в фиксированной памяти.
+    
+    Хранит не больше capacity счётчиков; новый ключ при заполнении вытесняет
+    минимальный и наследует его счёт. Оценка завышена не более чем на этот минимум.
+    """
+    __slots__ = ('capacity', 'counts')
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[int, int] = {}
+    
+    def add(self, key: int, count: int = 1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        else:
+            evicted = min(counts, key=counts.__getitem__)
+            counts[key] = counts.pop(evicted) + count
+    
+    def top(self, limit: int) -> List[Tuple[int, int]]:
+        return heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+    
+    def remap(self, mapping: Dict[int, int]):
+        self.counts = {mapping[key]: value for key, value in self.counts.items() if key in mapping}
+    
+    def to_bytes(self) -> bytes:
+        keys = array('I', self.counts.keys())
+        values = array('Q', self.counts.values())
+        return struct.pack('<I', len(keys)) + keys.tobytes() + values.tobytes()
+    
+    @classmethod
+    def from_bytes(cls, capacity: int, data: memoryview, offset: int):
+        """Прочитать счётчики из снапшота; вернуть (структуру, новое смещение)"""
+        (length,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        keys = array('I')
+        keys.frombytes(bytes(data[offset:offset + keys.itemsize * length]))
+        offset += keys.itemsize * length
+        values = array('Q')
+        values.frombytes(bytes(data[offset:offset + values.itemsize * length]))
+        offset += values.itemsize * length
+        item = cls(capacity)
+        item.counts = dict(zip(keys, values))
+        return item, offset
+
+class KnowledgeGraph:
+    """Граф знаний из сообщений.
+    
+    Сущности и отправители интернируются в плотные целые id, счётчики хранятся
+    в массивах, а «кто упоминал» — в компактных SenderSet. Рёбра совместной
+    встречаемости (в сообщении и в ветке ответов) и интересы пользователей —
+    ограниченные SpaceSaving, так что память не растёт с объёмом истории.
+    Состояние сохраняется бинарным снапшотом (save_snapshot / load_snapshot).
+    """
+    
+    def __init__(
+        self,
+        max_entities: Optional[int] = None,
+        snapshot_path: Optional[str] = None,
+        edge_capacity: Optional[int] = None,
+        interest_capacity: Optional[int] = None,
+        max_senders: Optional[int] = None
+    ):
         self.logger = logging.getLogger(__name__)
-        self.nodes = {}
-        self.edges = {}
-        self.user_profiles = {}
+        self.max_entities = max_entities or SETTINGS.KNOWLEDGE_GRAPH_MAX_ENTITIES
+        self.max_senders = max_senders or SETTINGS.KNOWLEDGE_GRAPH_MAX_SENDERS
+        self.snapshot_path = snapshot_path or SETTINGS.KNOWLEDGE_GRAPH_SNAPSHOT
+        self.edge_capacity = edge_capacity or SETTINGS.KNOWLEDGE_GRAPH_EDGE_CAPACITY
+        self.interest_capacity = interest_capacity or SETTINGS.KNOWLEDGE_GRAPH_INTEREST_CAPACITY
+        # Снапшот пишут и тренер (в потоке), и остановка бота — через один .tmp
+        self._snapshot_lock = threading.Lock()
+        self._reset()
         self.logger.info("🔗 KnowledgeGraph инициализирован")
     
+    def _reset(self):
+        # Сущности
+        self._entity_index: Dict[str, int] = {}
+        self._entity_names: List[str] = []
+        self._occurrences = array('Q')
+        self._first_seen = array('I')  # unix-время
+        self._mentioned_by: List[SenderSet] = []
+        # Отправители
+        self._sender_index: Dict[int, int] = {}
+        self._sender_ids = array('q')
+        self._activity = array('Q')
+        # Рёбра: сущность → SpaceSaving соседей; интересы: отправитель → SpaceSaving сущностей
+        self.edges: Dict[int, SpaceSaving] = {}
+        self._interests: Dict[int, SpaceSaving] = {}
+        # (chat_id, message_id) → сущности сообщения, для связей по reply_to
+        self._thread_cache: OrderedDict = OrderedDict()
+    
     async def extract_entities(self, text: str) -> List[str]:
-        """Используя простые паттерны"""
-        words = text.split()
-        return [w for w in words if len(w) > 3]  # Фильтр коротких слов
+        """Используя прекомпилированный токенизатор и стоп-слова"""
+        return extract_entities(text)
     
-    async def add_message_to_graph(self, message_id: int, text: str, sender_id: int):
+    async def add_message_to_graph(
+        self,
+        message_id: int,
+        text: str,
+        sender_id: int,
+        chat_id: Optional[int] = None,
+        reply_to_msg_id: Optional[int] = None
+    ):
         """Добавить инфо в граф"""
         entities = await self.extract_entities(text)
+        sender = self._intern_sender(sender_id) if sender_id is not None else None
+        now = int(datetime.now().timestamp())
         
+        entity_ids = []
         for entity in entities:
-            key = entity.lower()
-            if key not in self.nodes:
-                self.nodes[key] = {
-                    'occurrences': 0,
-                    'first_seen': datetime.now().isoformat(),
-                    'mentioned_by': set()
-                }
-            
-            self.nodes[key]['occurrences'] += 1
-            self.nodes[key]['mentioned_by'].add(sender_id)
-        
-        if sender_id not in self.user_profiles:
-            self.user_profiles[sender_id] = {
-                'interests': {},
-                'activity': 0
-            }
-        
-        self.user_profiles[sender_id]['activity'] += 1
+            entity_id = self._intern_entity(entity, now)
+            self._occurrences[entity_id] += 1
+            if entity_id not in entity_ids:
+                entity_ids.append(entity_id)
+        
+        if sender is not None:
+            self._activity[sender] += 1
+            interests = self._interests.get(sender)
+            if interests is None and entity_ids:
+                interests = self._interests[sender] = SpaceSaving(self.interest_capacity)
+            for entity_id in entity_ids:
+                self._mentioned_by[entity_id].add(sender)
+                interests.add(entity_id)
+        
+        paired = entity_ids[:MAX_PAIRED_ENTITIES]
+        self._link_pairs(paired)
+        if chat_id is not None:
+            if reply_to_msg_id is not None:
+                parent = self._thread_cache.get((chat_id, reply_to_msg_id))
+                if parent:
+                    self._link_across(paired, parent)
+            if paired:
+                self._remember_thread(chat_id, message_id, paired)
+        
+        if len(self._entity_names) > self.max_entities:
+            self._compact()
+        if len(self._sender_ids) > self.max_senders:
+            self._compact_senders()
+    
+    def _link(self, left: int, right: int):
+        edges = self.edges.get(left)
+        if edges is None:
+            edges = self.edges[left] = SpaceSaving(self.edge_capacity)
+        edges.add(right)
+    
+    def _link_pairs(self, entity_ids: List[int]):
+        for i, left in enumerate(entity_ids):
+            for right in entity_ids[i + 1:]:
+                self._link(left, right)
+                self._link(right, left)
+    
+    def _link_across(self, entity_ids: Iterable[int], parent_ids: Iterable[int]):
+        for left in entity_ids:
+            for right in parent_ids:
+                if left != right:
+                    self._link(left, right)
+                    self._link(right, left)
+    
+    def _remember_thread(self, chat_id: int, message_id: int, entity_ids: List[int]):
+        self._thread_cache[(chat_id, message_id)] = array('I', entity_ids)
+        if len(self._thread_cache) > THREAD_CACHE_SIZE:
+            self._thread_cache.popitem(last=False)
+    
+    def _intern_entity(self, key: str, now: int) -> int:
+        entity_id = self._entity_index.get(key)
+        if entity_id is None:
+            entity_id = len(self._entity_names)
+            self._entity_index[key] = entity_id
+            self._entity_names.append(key)
+            self._occurrences.append(0)
+            self._first_seen.append(now)
+            self._mentioned_by.append(SenderSet())
+        return entity_id
+    
+    def _intern_sender(self, sender_id: int) -> int:
+        index = self._sender_index.get(sender_id)
+        if index is None:
+            index = len(self._sender_ids)
+            self._sender_index[sender_id] = index
+            self._sender_ids.append(sender_id)
+            self._activity.append(0)
+        return index
+    
+    def _compact(self):
+        """Оставить самые частые сущности (3/4 лимита), остальные забыть"""
+        keep_count = self.max_entities * 3 // 4
+        keep = sorted(
+            range(len(self._entity_names)),
+            key=lambda entity_id: self._occurrences[entity_id],
+            reverse=True
+        )[:keep_count]
+        keep.sort()
+        
+        self._entity_names = [self._entity_names[i] for i in keep]
+        self._entity_index = {name: i for i, name in enumerate(self._entity_names)}
+        self._occurrences = array('Q', (self._occurrences[i] for i in keep))
+        self._first_seen = array('I', (self._first_seen[i] for i in keep))
+        self._mentioned_by = [self._mentioned_by[i] for i in keep]
+        
+        # Переписать ссылки на сущности в рёбрах, интересах и кэше веток
+        mapping = {old: new for new, old in enumerate(keep)}
+        self.edges = {mapping[owner]: edges for owner, edges in self.edges.items() if owner in mapping}
+        for counters in (*self.edges.values(), *self._interests.values()):
+            counters.remap(mapping)
+        for key, entity_ids in self._thread_cache.items():
+            self._thread_cache[key] = array('I', (mapping[i] for i in entity_ids if i in mapping))
+        self.logger.info(f"🧹 Граф знаний сжат до {len(keep)} сущностей")
+    
+    def _compact_senders(self):
+        """Оставить самых активных отправителей (3/4 лимита), остальных забыть"""
+        keep_count = self.max_senders * 3 // 4
+        keep = sorted(
+            range(len(self._sender_ids)),
+            key=lambda sender: self._activity[sender],
+            reverse=True
+        )[:keep_count]
+        keep.sort()
+        
+        self._sender_ids = array('q', (self._sender_ids[i] for i in keep))
+        self._activity = array('Q', (self._activity[i] for i in keep))
+        self._sender_index = {sender_id: i for i, sender_id in enumerate(self._sender_ids)}
+        
+        mapping = {old: new for new, old in enumerate(keep)}
+        self._interests = {
+            mapping[sender]: interests for sender, interests in self._interests.items() if sender in mapping
+        }
+        self._mentioned_by = [sender_set.remap(mapping) for sender_set in self._mentioned_by]
+        self.logger.info(f"🧹 Граф знаний: оставлено {len(keep)} отправителей")
+    
+    def get_entity(self, name: str) -> Optional[Dict]:
+        """Сведения о сущности"""
+        entity_id = self._entity_index.get(name.lower())
+        if entity_id is None:
+            return None
+        return {
+            'occurrences': self._occurrences[entity_id],
+            'first_seen': datetime.fromtimestamp(self._first_seen[entity_id]).isoformat(),
+            'mentioned_by_count': len(self._mentioned_by[entity_id])
+        }
+    
+    def top_entities(self, limit: int = 10) -> List[Dict]:
+        """Самые частые сущности"""
+        top = heapq.nlargest(
+            limit, range(len(self._entity_names)), key=self._occurrences.__getitem__
+        )
+        return [
+            {'entity': self._entity_names[i], 'occurrences': self._occurrences[i]}
+            for i in top
+        ]
+    
+    def get_related_entities(self, name: str, limit: int = 10) -> List[Dict]:
+        """Сущности, чаще всего встречающиеся вместе с данной (оценка сверху)"""
+        entity_id = self._entity_index.get(name.lower())
+        edges = self.edges.get(entity_id) if entity_id is not None else None
+        if edges is None:
+            return []
+        return [
+            {'entity': self._entity_names[other], 'weight': weight}
+            for other, weight in edges.top(limit)
+        ]
+    
+    def get_user_interests(self, user_id: int, limit: int = 10) -> List[Dict]:
+        """Сущности, о которых пользователь пишет чаще всего"""
+        sender = self._sender_index.get(user_id)
+        interests = self._interests.get(sender) if sender is not None else None
+        if interests is None:
+            return []
+        return [
+            {'entity': self._entity_names[entity_id], 'mentions': mentions}
+            for entity_id, mentions in interests.top(limit)
+        ]
     
     async def get_user_expertise(self, user_id: int) -> Dict:
         """Получить экспертизу пользователя"""
-        if user_id not in self.user_profiles:
+        sender = self._sender_index.get(user_id)
+        if sender is None:
             return {}
         
-        profile = self.user_profiles[user_id]
+        activity = self._activity[sender]
         return {
-            'activity_level': profile['activity'],
-            'expertise_score': profile['activity']
+            'activity_level': activity,
+            'expertise_score': activity,
+            'top_interests': self.get_user_interests(user_id, limit=5)
         }
+    
+    def save_snapshot(self, path: Optional[str] = None):
+        """Сохранить граф в сжатый бинарный снапшот (атомарно)"""
+        path = path or self.snapshot_path
+        header = json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'entities': len(self._entity_names),
+            'senders': len(self._sender_ids)
+        }).encode()
+        names = '\n'.join(self._entity_names).encode('utf-8')
+        
+        parts = [struct.pack('<I', len(header)), header, struct.pack('<Q', len(names)), names]
+        for values in (self._occurrences, self._first_seen, self._sender_ids, self._activity):
+            parts.append(values.tobytes())
+        parts.extend(sender_set.to_bytes() for sender_set in self._mentioned_by)
+        for tables in (self.edges, self._interests):
+            parts.append(struct.pack('<I', len(tables)))
+            for owner, counters in tables.items():
+                parts.append(struct.pack('<I', owner))
+                parts.append(counters.to_bytes())
+        
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with self._snapshot_lock:
+            with open(tmp_path, 'wb') as f:
+                f.write(SNAPSHOT_MAGIC)
+                f.write(zlib.compress(b''.join(parts), 6))
+            os.replace(tmp_path, path)
+        self.logger.info(f"💾 Снапшот графа знаний: {len(self._entity_names)} сущностей → {path}")
+    
+    def load_snapshot(self, path: Optional[str] = None) -> bool:
+        """Восстановить граф из снапшота; False, если снапшота нет или он несовместим"""
+        path = path or self.snapshot_path
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                self.logger.warning(f"⚠️ {path}: не снапшот графа знаний")
+                return False
+            data = memoryview(zlib.decompress(f.read()))
+        
+        (header_length,) = struct.unpack_from('<I', data, 0)
+        offset = 4
+        header = json.loads(bytes(data[offset:offset + header_length]))
+        offset += header_length
+        if header['version'] not in (1, SNAPSHOT_VERSION):
+            self.logger.warning(f"⚠️ Версия снапшота {header['version']} не поддерживается")
+            return False
+        
+        self._reset()
+        (names_length,) = struct.unpack_from('<Q', data, offset)
+        offset += 8
+        names = bytes(data[offset:offset + names_length]).decode('utf-8')
+        offset += names_length
+        self._entity_names = names.split('\n') if header['entities'] else []
+        self._entity_index = {name: i for i, name in enumerate(self._entity_names)}
+        
+        for values, count in (
+            (self._occurrences, header['entities']),
+            (self._first_seen, header['entities']),
+            (self._sender_ids, header['senders']),
+            (self._activity, header['senders'])
+        ):
+            size = values.itemsize * count
+            values.frombytes(bytes(data[offset:offset + size]))
+            offset += size
+        self._sender_index = {sender_id: i for i, sender_id in enumerate(self._sender_ids)}
+        
+        for _ in range(header['entities']):
+            sender_set, offset = SenderSet.from_bytes(data, offset)
+            self._mentioned_by.append(sender_set)
+        
+        # Версия 1 не содержит рёбер и интересов
+        if header['version'] >= 2:
+            for tables, capacity in ((self.edges, self.edge_capacity),
+                                     (self._interests, self.interest_capacity)):
+                (length,) = struct.unpack_from('<I', data, offset)
+                offset += 4
+                for _ in range(length):
+                    (owner,) = struct.unpack_from('<I', data, offset)
+                    tables[owner], offset = SpaceSaving.from_bytes(capacity, data, offset + 4)
+        
+        self.logger.info(f"📂 Граф знаний восстановлен: {len(self._entity_names)} сущностей")
+        return True
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from config.settings import SETTINGS
+from database.repositories.message_repo import MessageRepository
+from utils.profiling import traced
+
+# Обучать IVF-разбиение, когда в индексе чата накопилось столько векторов;
+# до этого поиск — полный перебор (на таких объёмах это и так доли миллисекунды)
+IVF_TRAIN_MIN_ROWS = 20000
+# Максимальная выборка для k-means
+IVF_TRAIN_SAMPLE = 100000
+IVF_TRAIN_ITERATIONS = 10
+# Перестраивать инвертированные списки, когда «хвост» новых строк больше этого
+TAIL_REBUILD_ROWS = 10000
+ASSIGN_CHUNK_ROWS = 65536
+
+def _to_epoch(moment: Optional[datetime]) -> int:
+    """unix-время; naive datetime (как message_date в БД) считается UTC"""
+    if not moment:
+        return 0
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """k-means по косинусу для нормированных векторов; возвращает центроиды (nlist, dim)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(IVF_TRAIN_ITERATIONS):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(np.float32)
+    return centroids
+
+class ChatVectorIndex:
+    """IVF-Flat индекс эмбеддингов одного чата на диске (memory-mapped).
+    
+    Файлы (только дописываются): vectors.f32, ids.i64 (Message.id),
+    dates.i64 (unix-время), lists.i32 (номер IVF-списка, -1 — не назначен);
+    centroids.npy появляется после обучения.
+    
+    Методы блокирующие (k-means, перестройка списков) — SemanticIndex вызывает
+    их через asyncio.to_thread; RLock не даёт поиску читать отображения,
+    которые в это время пересоздаёт запись или обучение.
+    """
+    
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        
+        self._files = {
+            'vectors': (os.path.join(path, 'vectors.f32'), np.float32, dim),
+            'ids': (os.path.join(path, 'ids.i64'), np.int64, 1),
+            'dates': (os.path.join(path, 'dates.i64'), np.int64, 1),
+            'lists': (os.path.join(path, 'lists.i32'), np.int32, 1),
+        }
+        self.count = self._consistent_rows()
+        self.centroids = None
+        centroids_path = os.path.join(path, 'centroids.npy')
+        if os.path.exists(centroids_path):
+            self.centroids = np.load(centroids_path, mmap_mode='r')
+        
+        self._maps = {}
+        self._mapped_rows = 0
+        self._list_rows = None
+        self._indexed_rows = 0
+        self._remap()
+    
+    def _consistent_rows(self) -> int:
+        """Число полностью записанных строк; недописанный хвост обрезается"""
+        rows = None
+        for path, dtype, width in self._files.values():
+            row_bytes = np.dtype(dtype).itemsize * width
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            rows = size // row_bytes if rows is None else min(rows, size // row_bytes)
+        for path, dtype, width in self._files.values():
+            if os.path.exists(path):
+                os.truncate(path, rows * np.dtype(dtype).itemsize * width)
+        return rows
+    
+    def _remap(self):
+        self._remap_files()
+        self._build_lists()
+    
+    def _remap_files(self):
+        self._mapped_rows = self.count
+        self._maps = {}
+        if not self.count:
+            return
+        for name, (path, dtype, width) in self._files.items():
+            shape = (self.count, width) if width > 1 else (self.count,)
+            self._maps[name] = np.memmap(path, dtype=dtype, mode='r', shape=shape)
+    
+    def _build_lists(self):
+        """Инвертированные списки IVF: строки индекса, сгруппированные по центроиду"""
+        if self.centroids is None or not self.count:
+            self._list_rows = None
+            self._indexed_rows = 0
+            return
+        lists = np.asarray(self._maps['lists'])
+        assigned = np.flatnonzero(lists >= 0)
+        order = assigned[np.argsort(lists[assigned], kind='stable')]
+        bounds = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+        self._list_rows = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        self._indexed_rows = self.count
+    
+    def add(self, message_ids: np.ndarray, dates: np.ndarray, vectors: np.ndarray):
+        """Дописать нормированные векторы сообщений (обучает IVF при накоплении)"""
+        if not len(message_ids):
+            return
+        with self._lock:
+            self._add(message_ids, dates, vectors)
+    
+    def _add(self, message_ids: np.ndarray, dates: np.ndarray, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.centroids is not None:
+            lists = np.argmax(vectors @ np.asarray(self.centroids).T, axis=1).astype(np.int32)
+        else:
+            lists = np.full(len(message_ids), -1, dtype=np.int32)
+        
+        data = {
+            'vectors': vectors,
+            'ids': np.asarray(message_ids, dtype=np.int64),
+            'dates': np.asarray(dates, dtype=np.int64),
+            'lists': lists,
+        }
+        for name, (path, dtype, _) in self._files.items():
+            with open(path, 'ab') as f:
+                f.write(data[name].astype(dtype, copy=False).tobytes())
+        self.count += len(message_ids)
+        
+        if self.centroids is None and self.count >= IVF_TRAIN_MIN_ROWS:
+            self._train()
+    
+    def train(self):
+        """Обучить IVF-центроиды и разметить все строки"""
+        with self._lock:
+            self._train()
+    
+    def _train(self):
+        self._remap()
+        vectors = self._maps['vectors']
+        nlist = max(1, int(np.sqrt(self.count)))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(self.count, min(self.count, IVF_TRAIN_SAMPLE), replace=False))
+        centroids = _spherical_kmeans(np.asarray(vectors[sample_rows]), nlist)
+        
+        lists = np.empty(self.count, dtype=np.int32)
+        for start in range(0, self.count, ASSIGN_CHUNK_ROWS):
+            chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_ROWS])
+            lists[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        
+        lists_path = self._files['lists'][0]
+        self._maps.pop('lists', None)
+        lists.tofile(lists_path)
+        np.save(os.path.join(self.path, 'centroids.npy'), centroids)
+        self.centroids = centroids
+        self._remap()
+        self.logger.info(f"🧭 IVF-индекс обучен: {self.count} векторов, {nlist} списков ({self.path})")
+    
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int = 10,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        nprobe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """top_k (Message.id, косинус) с фильтром по дате"""
+        with self._lock:
+            return self._search(query, top_k, date_from, date_to, nprobe)
+    
+    def _search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        date_from: Optional[datetime],
+        date_to: Optional[datetime],
+        nprobe: Optional[int]
+    ) -> List[Tuple[int, float]]:
+        if self.count != self._mapped_rows:
+            if self.centroids is not None and self.count - self._indexed_rows <= TAIL_REBUILD_ROWS:
+                # Новые строки ищем перебором «хвоста», списки перестраиваем пореже
+                self._remap_files()
+            else:
+                self._remap()
+        if not self.count:
+            return []
+        
+        if self._list_rows is not None:
+            nprobe = min(nprobe or SETTINGS.SEMANTIC_INDEX_NPROBE, len(self.centroids))
+            centroid_scores = np.asarray(self.centroids) @ query
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+            candidates = np.concatenate(
+                [self._list_rows[i] for i in probe] +
+                [np.arange(self._indexed_rows, self.count)]
+            )
+        else:
+            candidates = np.arange(self.count)
+        
+        if date_from or date_to:
+            dates = self._maps['dates'][candidates]
+            mask = np.ones(len(candidates), dtype=bool)
+            if date_from:
+                mask &= dates >= _to_epoch(date_from)
+            if date_to:
+                mask &= dates <= _to_epoch(date_to)
+            candidates = candidates[mask]
+        if not len(candidates):
+            return []
+        
+        candidates.sort()  # последовательное чтение из mmap
+        scores = self._maps['vectors'][candidates] @ query
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        ids = self._maps['ids'][candidates[top]]
+        return [(int(message_id), float(score)) for message_id, score in zip(ids, scores[top])]
+
+class SemanticIndex:
+    """Набор векторных индексов по чатам: Message.id ↔ эмбеддинг текста"""
+    
+    def __init__(self, embeddings, base_dir: Optional[str] = None):
+        self.embeddings = embeddings
+        self.dim = embeddings.store.dim
+        self.base_dir = base_dir or SETTINGS.SEMANTIC_INDEX_DIR
+        self.logger = logging.getLogger(__name__)
+        self._indexes: Dict[int, ChatVectorIndex] = {}
+        os.makedirs(self.base_dir, exist_ok=True)
+        
+        self._meta_path = os.path.join(self.base_dir, 'meta.json')
+        self.last_message_id = 0
+        self.horizon_id = 0
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            self.last_message_id = meta.get('last_message_id', 0)
+            self.horizon_id = meta.get('horizon_id', self.last_message_id)
+        
+        # Загрузить (memory-map) уже существующие индексы
+        for name in os.listdir(self.base_dir):
+            if name.lstrip('-').isdigit():
+                self.get(int(name))
+    
+    def get(self, chat_id: int) -> ChatVectorIndex:
+        index = self._indexes.get(chat_id)
+        if index is None:
+            index = ChatVectorIndex(os.path.join(self.base_dir, str(chat_id)), self.dim)
+            self._indexes[chat_id] = index
+        return index
+    
+    async def add_messages(self, rows: Iterable) -> int:
+        """Проиндексировать сообщения; rows — (id, telegram_chat_id, message_date, text)"""
+        rows = [row for row in rows if row[3]]
+        if not rows:
+            return 0
+        vectors = await self.embeddings.embed_batch([row[3] for row in rows])
+        
+        by_chat: Dict[int, List[int]] = {}
+        for position, row in enumerate(rows):
+            by_chat.setdefault(row[1], []).append(position)
+        for chat_id, positions in by_chat.items():
+            # Запись может запустить k-means — не в event loop
+            await asyncio.to_thread(
+                self.get(chat_id).add,
+                np.array([rows[p][0] for p in positions]),
+                np.array([_to_epoch(rows[p][2]) for p in positions]),
+                vectors[positions]
+            )
+        return len(rows)
+    
+    @traced()
+    async def search(
+        self,
+        query: str,
+        chat_id: Optional[int] = None,
+        top_k: int = 10,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None
+    ) -> List[Tuple[int, float]]:
+        """Найти top_k ближайших сообщений: [(Message.id, косинус)]"""
+        query_vector = await self.embeddings.embed_message(query)
+        if chat_id is not None:
+            if chat_id not in self._indexes:
+                return []
+            indexes = [self._indexes[chat_id]]
+        else:
+            indexes = list(self._indexes.values())
+        # Поиск может перестраивать списки IVF после записи — не в event loop
+        return await asyncio.to_thread(self._search_indexes, indexes, query_vector, top_k, date_from, date_to)
+    
+    @staticmethod
+    def _search_indexes(indexes, query_vector, top_k, date_from, date_to) -> List[Tuple[int, float]]:
+        results = []
+        for index in indexes:
+            results.extend(index.search(query_vector, top_k, date_from, date_to))
+        return sorted(results, key=lambda item: item[1], reverse=True)[:top_k]
+    
+    async def sync(self, message_repo, batch_size: int = 1000) -> int:
+        """Догнать БД: проиндексировать сообщения с id больше последнего проиндексированного.
+        
+        Читает только до максимального id, замеченного прошлым вызовом: строки
+        параллельных писателей коммитятся не по порядку id (см. AutoTrainer).
+        """
+        horizon = self.horizon_id
+        self.horizon_id = max(horizon, await message_repo.get_max_message_id())
+        total = 0
+        async for batch in message_repo.iter_message_batches(
+            after_id=self.last_message_id,
+            up_to_id=horizon,
+            columns=['id', 'telegram_chat_id', 'message_date', 'text'],
+            batch_size=batch_size
+        ):
+            total += await self.add_messages(batch)
+            # Пустые тексты тоже сдвигают водяной знак
+            self.last_message_id = max(self.last_message_id, batch[-1][0])
+            self._save_meta()
+        self.last_message_id = max(self.last_message_id, horizon)
+        self._save_meta()
+        if total:
+            self.logger.info(f"🧭 Проиндексировано сообщений: {total}")
+        return total
+    
+    async def start_continuous_sync(self, session_factory, interval: Optional[int] = None):
+        """Фоновая индексация новых сообщений"""
+        interval = interval or SETTINGS.SEMANTIC_INDEX_SYNC_INTERVAL
+        self.logger.info("🧭 Семантическая индексация запущена")
+        while True:
+            try:
+                async with session_factory() as session:
+                    await self.sync(MessageRepository(session))
+            except Exception as e:
+                self.logger.error(f"❌ Ошибка индексации: {e}")
+            await asyncio.sleep(interval)
+    
+    def _save_meta(self):
+        with open(self._meta_path, 'w') as f:
+            json.dump({
+                'last_message_id': self.last_message_id,
+                'horizon_id': self.horizon_id,
+                'dim': self.dim
+            }, f)
@@ -1,48 +1,160 @@
 import asyncio
+import json
 import logging
-from datetime import datetime, timedelta
+import os
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+from config.settings import SETTINGS
+from database.connection import async_session
 from database.repositories.message_repo import MessageRepository
-from ml.models.embeddings import ContextualEmbeddings
 from ml.models.knowledge_graph import KnowledgeGraph
+from utils.profiling import traced
+
+if TYPE_CHECKING:
+    # Без импорта во время выполнения: torch и sklearn грузятся только вместе с моделями
+    from ml.models.embeddings import ContextualEmbeddings
+    from ml.models.intent_classifier import IntentClassifier
+
+TRAINING_COLUMNS = [
+    'id', 'telegram_chat_id', 'telegram_message_id', 'telegram_sender_id', 'reply_to_msg_id', 'text'
+]
 
 class AutoTrainer:
-    """Автоматическое обучение"""
+    """Автоматическое обучение.
+    
+    Инкрементально: каждый цикл обрабатывает только сообщения с id больше
+    сохранённого водяного знака, пачками по chunk_size, в своей сессии.
+    
+    id выдаются при вставке, а видны после commit: параллельные писатели
+    коммитят не по порядку id. Поэтому цикл читает только до горизонта —
+    наибольшего id, замеченного в прошлом цикле: все транзакции, получившие
+    id до того момента, к следующему циклу уже завершены.
+    """
     
     def __init__(
         self,
-        message_repo: MessageRepository,
-        embeddings: ContextualEmbeddings,
-        knowledge_graph: KnowledgeGraph
+        session_factory,
+        embeddings: Optional['ContextualEmbeddings'],
+        knowledge_graph: Optional[KnowledgeGraph],
+        state_path: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        min_messages: Optional[int] = None,
+        intent_classifier: Optional['IntentClassifier'] = None
     ):
-        self.message_repo = message_repo
+        self.session_factory = session_factory or async_session
         self.embeddings = embeddings
         self.knowledge_graph = knowledge_graph
+        self.intent_classifier = intent_classifier
         self.logger = logging.getLogger(__name__)
         
+        self.state_path = state_path or SETTINGS.ML_TRAINER_STATE
+        self.chunk_size = chunk_size or SETTINGS.ML_TRAINING_CHUNK_SIZE
+        self.min_messages = min_messages or SETTINGS.ML_MIN_MESSAGES_TO_TRAIN
+        self.last_message_id = 0
+        self.horizon_id = 0
         self.last_training = None
-        self.training_interval = timedelta(hours=6)
-    
-    async def should_train(self) -> bool:
-        """Проверить, нужно ли обучать"""
-        if self.last_training is None:
-            return True
-        return datetime.now() - self.last_training > self.training_interval
-    
-    async def auto_train(self):
-        """Автообучение"""
-        if not await self.should_train():
-            self.logger.info("⏭️ Обучение пока не требуется")
+        self._load_state()
+    
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
             return
-        
         try:
-            self.logger.info("🎣 Начинается автообучение...")
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self.last_message_id = state.get('last_message_id', 0)
+            self.horizon_id = state.get('horizon_id', self.last_message_id)
+            if state.get('last_training'):
+                self.last_training = datetime.fromisoformat(state['last_training'])
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"⚠️ Состояние обучения не прочитано ({e}), начинаем сначала")
+    
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'last_message_id': self.last_message_id,
+                'horizon_id': self.horizon_id,
+                'last_training': self.last_training.isoformat() if self.last_training else None
+            }, f)
+        os.replace(tmp_path, self.state_path)
+    
+    async def should_train(self, message_repo: MessageRepository, up_to_id: Optional[int] = None) -> bool:
+        """Проверить, нужно ли обучать: накопилось ли ML_MIN_MESSAGES_TO_TRAIN новых сообщений"""
+        new_messages = await message_repo.count_messages_after(self.last_message_id, up_to_id)
+        if new_messages < self.min_messages:
+            self.logger.info(f"⏭️ Новых сообщений: {new_messages} из {self.min_messages}")
+            return False
+        return True
+    
+    @traced()
+    async def auto_train(self) -> int:
+        """Автообучение на сообщениях новее водяного знака; вернуть кол-во обработанных"""
+        processed = 0
+        try:
+            async with self.session_factory() as session:
+                message_repo = MessageRepository(session)
+                # Горизонт прошлого цикла — для чтения, текущий максимум — для следующего
+                horizon = self.horizon_id
+                self.horizon_id = max(horizon, await message_repo.get_max_message_id())
+                self._save_state()
+                if not await self.should_train(message_repo, up_to_id=horizon):
+                    return 0
+                
+                self.logger.info(f"🎣 Начинается автообучение: id {self.last_message_id}..{horizon}")
+                async for batch in message_repo.iter_message_batches(
+                    after_id=self.last_message_id,
+                    up_to_id=horizon,
+                    columns=TRAINING_COLUMNS,
+                    batch_size=self.chunk_size
+                ):
+                    await self._train_batch(batch)
+                    processed += len(batch)
+                    # Сдвигать водяной знак после каждой пачки: после сбоя продолжим с неё
+                    self.last_message_id = batch[-1].id
+                    self._save_state()
+                # До горизонта прочитано всё, включая пропуски в последовательности
+                self.last_message_id = max(self.last_message_id, horizon)
+            
             self.last_training = datetime.now()
-            self.logger.info("✅ Обучение завершено")
+            self._save_state()
+            if self.knowledge_graph:
+                await asyncio.to_thread(self.knowledge_graph.save_snapshot)
+            if self.intent_classifier:
+                await asyncio.to_thread(self.intent_classifier.save)
+            self.logger.info(f"✅ Обучение завершено: {processed} сообщений")
         except Exception as e:
             self.logger.error(f"❌ Ошибка: {e}")
+        return processed
+    
+    async def _train_batch(self, batch: list):
+        rows = [row for row in batch if row.text]
+        if not rows:
+            return
+        
+        if self.embeddings:
+            # Векторы оседают в дисковом кэше и переиспользуются поиском
+            await self.embeddings.embed_batch([row.text for row in rows])
+        
+        if self.intent_classifier:
+            from ml.models.intent_classifier import weak_label
+            texts = [row.text for row in rows]
+            labels = [weak_label(row.text, is_reply=row.reply_to_msg_id is not None) for row in rows]
+            await asyncio.to_thread(self.intent_classifier.partial_fit, texts, labels)
+        
+        if self.knowledge_graph:
+            for row in rows:
+                await self.knowledge_graph.add_message_to_graph(
+                    row.telegram_message_id,
+                    row.text,
+                    row.telegram_sender_id,
+                    chat_id=row.telegram_chat_id,
+                    reply_to_msg_id=row.reply_to_msg_id
+                )
     
-    async def start_continuous_training(self, check_interval: int = 3600):
+    async def start_continuous_training(self, check_interval: Optional[int] = None):
         """Фоновое обучение"""
+        check_interval = check_interval or SETTINGS.ML_TRAINING_INTERVAL
         self.logger.info("🔄 Непрерывное обучение запущено")
         while True:
             try:
@@ -1,25 +1,46 @@
+from database.connection import async_session
 from database.repositories.message_repo import MessageRepository
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Optional
 import logging
 
 class AnalyticsService:
-    """Аналитика сообщений"""
+    """Аналитика сообщений (каждый запрос — своя короткая сессия из пула)"""
     
-    def __init__(self, message_repo: MessageRepository):
-        self.message_repo = message_repo
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory or async_session
         self.logger = logging.getLogger(__name__)
     
-    async def get_activity_timeline(self, chat_id: int, days: int = 30) -> Dict:
-        """График активности"""
+    async def get_activity_timeline(
+        self,
+        chat_id: int,
+        days: int = 30,
+        granularity: str = 'day'
+    ) -> Dict:
+        """График активности (granularity: 'hour' или 'day')"""
         date_from = datetime.now() - timedelta(days=days)
-        activity = await self.message_repo.get_user_activity(chat_id, days)
-        return {'activity': activity}
+        async with self.session_factory() as session:
+            message_repo = MessageRepository(session)
+            timeline = await message_repo.get_activity_timeline(chat_id, date_from, granularity)
+            activity = await message_repo.get_user_activity(chat_id, days)
+        return {
+            'date_from': date_from,
+            'granularity': granularity,
+            'timeline': timeline,
+            'activity': activity
+        }
     
-    async def get_top_users(self, chat_id: int, limit: int = 10):
+    async def get_top_users(self, chat_id: int, limit: int = 10, days: int = 7):
         """Топ активных"""
-        return await self.message_repo.get_user_activity(chat_id)
+        async with self.session_factory() as session:
+            return await MessageRepository(session).get_user_activity(chat_id, days, limit=limit)
     
     async def get_chat_statistics(self, chat_id: int) -> Dict:
         """Общая статистика"""
-        return await self.message_repo.get_chat_statistics(chat_id)
+        async with self.session_factory() as session:
+            return await MessageRepository(session).get_chat_statistics(chat_id)
+    
+    async def rebuild_statistics(self, chat_id: Optional[int] = None) -> int:
+        """Пересчитать кэш статистики и роллапы с нуля (ремонт счётчиков)"""
+        async with self.session_factory() as session:
+            return await MessageRepository(session).rebuild_statistics(chat_id)
@@ -0,0 +1,115 @@
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from database.connection import async_session
+from database.repositories.message_repo import MessageRepository
+from database.archive import ARCHIVE_COLUMNS, MessageArchive, get_archive
+from database import partitioning
+from config.settings import SETTINGS
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+import logging
+
+ARCHIVE_LOCK_TIMEOUT = '5s'
+
+class RetentionService:
+    """Перенос секций messages старше N месяцев в Parquet-архив"""
+    
+    def __init__(
+        self,
+        session_factory=None,
+        archive: Optional[MessageArchive] = None,
+        retention_months: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ):
+        self.session_factory = session_factory or async_session
+        self.archive = archive or get_archive()
+        self.retention_months = retention_months or SETTINGS.MESSAGES_RETENTION_MONTHS
+        self.chunk_size = chunk_size or SETTINGS.ARCHIVE_CHUNK_SIZE
+        self.logger = logging.getLogger(__name__)
+    
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        """Секции с месяцем раньше этой даты уходят в архив"""
+        return partitioning.add_months(
+            partitioning.month_start(now or datetime.now()), -self.retention_months
+        )
+    
+    async def archive_expired(self) -> List[str]:
+        """Архивировать и удалить все просроченные секции; вернуть пути файлов"""
+        if not partitioning.is_partitioned():
+            self.logger.info("🧊 messages не секционирована — архивирование пропущено")
+            return []
+        cutoff = self.cutoff()
+        async with self.session_factory() as session:
+            partitions = await partitioning.list_partitions(session)
+        
+        paths = []
+        for month, name in partitions:
+            if month >= cutoff:
+                break
+            path = await self.archive_partition(month, name)
+            if path:
+                paths.append(path)
+        return paths
+    
+    async def archive_partition(self, month: datetime, name: str) -> Optional[str]:
+        """Выгрузить секцию в Parquet, затем DETACH + DROP.
+        
+        Файл получает окончательное имя (и становится виден поиску) только
+        после DETACH + DROP, перед самым commit; если секция занята или
+        изменилась, временный файл удаляется. Сбой между rename и commit
+        оставляет данные в обоих местах — повтор перезапишет тот же файл.
+        """
+        writer = self.archive.open_partition(month, name)
+        try:
+            async with self.session_factory() as session:
+                batches = MessageRepository(session).iter_message_batches(
+                    since=month, until=partitioning.next_month(month),
+                    columns=ARCHIVE_COLUMNS, batch_size=self.chunk_size
+                )
+                async for batch in batches:
+                    await asyncio.to_thread(writer.write, [tuple(row) for row in batch])
+            await asyncio.to_thread(writer.close)
+            
+            async with self.session_factory() as session:
+                # Порядок блокировок как у записи: advisory DDL секций, затем messages, затем секция.
+                # DETACH всё равно требует ACCESS EXCLUSIVE на messages — берём её сразу, без повышения.
+                # lock_timeout: очередь за этой блокировкой остановила бы запись — лучше отложить
+                await session.execute(text(f"SET LOCAL lock_timeout = '{ARCHIVE_LOCK_TIMEOUT}'"))
+                try:
+                    await partitioning.lock_partitions(session)
+                    await session.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+                    await session.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+                except DBAPIError as e:
+                    await session.rollback()
+                    await asyncio.to_thread(writer.abort)
+                    self.logger.warning(f"⚠️ Секция {name} занята, архивирование отложено: {e.orig}")
+                    return None
+                # Запись в старый месяц (догрузка истории) во время выгрузки — повторим в следующий раз
+                current = (await session.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+                if current != writer.rows:
+                    await session.rollback()
+                    await asyncio.to_thread(writer.abort)
+                    self.logger.warning(f"⚠️ Секция {name} изменилась во время выгрузки — отложено")
+                    return None
+                await session.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+                await session.execute(text(f"DROP TABLE {name}"))
+                path = await asyncio.to_thread(writer.publish)
+                await session.commit()
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        partitioning.forget_partition(month)
+        self.logger.info(f"🧊 Секция {name} архивирована: {writer.rows} сообщений")
+        return path
+    
+    async def start_periodic(self, interval: Optional[int] = None):
+        """Фоновое архивирование раз в interval секунд"""
+        interval = interval or SETTINGS.ARCHIVE_INTERVAL
+        self.logger.info(f"🧊 Архивирование секций старше {self.retention_months} мес. запущено")
+        while True:
+            try:
+                await self.archive_expired()
+            except Exception as e:
+                self.logger.error(f"❌ Ошибка архивирования: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,253 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Границы бакетов по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Базовая метрика: набор дочерних серий по значениям меток"""
+    kind = ''
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        REGISTRY.register(self)
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, **labels):
+        """Серия с конкретными значениями меток"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def remove(self, **labels):
+        self._children.pop(tuple(str(labels[name]) for name in self.labelnames), None)
+    
+    def _samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+    
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+class _Value:
+    __slots__ = ('value',)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+    
+    def dec(self, amount: float = 1):
+        self.value -= amount
+    
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Metric):
+    """Монотонный счётчик (скорость — через rate() в Prometheus)"""
+    kind = 'counter'
+    
+    def _new_child(self):
+        return _Value()
+    
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+    
+    def _samples(self):
+        return [
+            ('_total', _format_labels(self.labelnames, key), child.value)
+            for key, child in list(self._children.items())
+        ]
+
+class Gauge(_Metric):
+    """Текущее значение; set_function — значение вычисляется при каждом сборе"""
+    kind = 'gauge'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self._function: Optional[Callable[[], float]] = None
+        super().__init__(name, documentation, labelnames)
+    
+    def _new_child(self):
+        return _Value()
+    
+    def set(self, value: float):
+        self._children[()].set(value)
+    
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+    
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+    
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+    
+    def _samples(self):
+        if self._function is not None:
+            try:
+                return [('', '', self._function())]
+            except Exception:
+                return []
+        return [
+            ('', _format_labels(self.labelnames, key), child.value)
+            for key, child in list(self._children.items())
+        ]
+
+class _Timer:
+    __slots__ = ('_histogram', '_started')
+    
+    def __init__(self, histogram):
+        self._histogram = histogram
+    
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+    
+    def time(self) -> _Timer:
+        """Контекстный менеджер: наблюдать длительность блока в секундах"""
+        return _Timer(self)
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными бакетами (кумулятивные счётчики при выдаче)"""
+    kind = 'histogram'
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+    
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+    
+    def observe(self, value: float):
+        self._children[()].observe(value)
+    
+    def time(self) -> _Timer:
+        return self._children[()].time()
+    
+    def _samples(self):
+        samples = []
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                samples.append((
+                    '_bucket', _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"'),
+                    cumulative
+                ))
+            samples.append(('_bucket', _format_labels(self.labelnames, key, 'le="+Inf"'), child.count))
+            samples.append(('_sum', _format_labels(self.labelnames, key), child.sum))
+            samples.append(('_count', _format_labels(self.labelnames, key), child.count))
+        return samples
+
+class Registry:
+    """Все метрики процесса; render() — текстовый формат Prometheus"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+    
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+    
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+REGISTRY = Registry()
+
+# === Запись сообщений ===
+STAGE_SECONDS = Histogram(
+    'tglogger_stage_seconds',
+    'Latency of message processing stages (entity_lookup, enqueue, db_write, commit, process)',
+    ['stage']
+)
+CHAT_UPDATES = Counter('tglogger_chat_updates', 'New message updates received per chat', ['chat_id'])
+INGEST_QUEUE_DEPTH = Gauge('tglogger_ingest_queue_depth', 'Messages waiting in the write-behind queue')
+INGEST_BATCH_SIZE = Histogram(
+    'tglogger_ingest_batch_size', 'Messages per write-behind flush', buckets=SIZE_BUCKETS
+)
+
+# === Сканирование истории ===
+SCAN_MESSAGES = Counter('tglogger_scan_messages', 'History messages saved by the scanner', ['chat_id'])
+SCAN_MAX_MESSAGE_ID = Gauge('tglogger_scan_max_message_id', 'Newest scanned message id', ['chat_id'])
+SCAN_MIN_MESSAGE_ID = Gauge('tglogger_scan_min_message_id', 'Oldest scanned message id', ['chat_id'])
+SCAN_HISTORY_COMPLETE = Gauge(
+    'tglogger_scan_history_complete', '1 when the full history of the chat is saved', ['chat_id']
+)
+
+# === Пул соединений БД ===
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    'tglogger_db_pool_checkout_seconds', 'Time spent waiting for a pooled DB connection'
+)
+DB_POOL_CHECKED_OUT = Gauge('tglogger_db_pool_checked_out', 'Connections currently in use')
+DB_POOL_SIZE = Gauge('tglogger_db_pool_size', 'Configured connection pool size')
+
+# === ML ===
+EMBEDDING_BATCH_SECONDS = Histogram('tglogger_embedding_batch_seconds', 'Embedding model encode() time per batch')
+EMBEDDING_BATCH_SIZE = Histogram(
+    'tglogger_embedding_batch_size', 'Texts per embedding encode() call', buckets=SIZE_BUCKETS
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    'tglogger_embedding_cache_lookups', 'Embedding lookups by result (hit, miss)', ['result']
+)
+ENRICHMENT_QUEUE_DEPTH = Gauge('tglogger_enrichment_queue_depth', 'Message ids waiting for enrichment')
+ENRICHMENT_DROPPED = Counter('tglogger_enrichment_dropped', 'Message ids dropped by the enrichment stage')
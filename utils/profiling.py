@@ -0,0 +1,136 @@
+import asyncio
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import signal
+import time
+from datetime import datetime
+from typing import Optional
+from config.settings import SETTINGS
+from utils.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+SPAN_SECONDS = Histogram('tglogger_span_seconds', 'Duration of traced spans', ['span'])
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+# === Трассировка ===
+
+def traced(name: Optional[str] = None):
+    """Декоратор корутины: span с длительностью в метрике и в DEBUG-логе.
+    
+    Решение принимается при импорте: с ENABLE_TRACING=false функция
+    возвращается как есть, без обёртки и накладных расходов.
+    """
+    def decorator(function):
+        if not SETTINGS.ENABLE_TRACING:
+            return function
+        span_name = name or function.__qualname__
+        histogram = SPAN_SECONDS.labels(span=span_name)
+        
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            path = f'{parent}/{span_name}' if parent else span_name
+            token = _current_span.set(path)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                _current_span.reset(token)
+                histogram.observe(elapsed)
+                logger.debug(f"⏱️ {path}: {elapsed * 1000:.1f}ms")
+        return wrapper
+    return decorator
+
+# === Медленные колбэки ===
+
+_original_handle_run = None
+
+def _describe(handle) -> str:
+    """Имя корутины, чей шаг выполнял колбэк (repr Handle его не показывает)"""
+    owner = getattr(getattr(handle, '_callback', None), '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return f"{owner.get_name()} {getattr(coro, '__qualname__', coro)!s}"
+    return repr(handle)
+
+def install_slow_callback_detector(threshold_ms: Optional[int] = None):
+    """Логировать каждый шаг event loop, блокирующий его дольше порога.
+    
+    В отличие от loop.set_debug(True), не включает остальные проверки
+    режима отладки asyncio: остаётся два вызова perf_counter на колбэк.
+    """
+    global _original_handle_run
+    threshold = (threshold_ms or SETTINGS.SLOW_CALLBACK_MS) / 1000
+    if threshold <= 0 or _original_handle_run is not None:
+        return
+    
+    _original_handle_run = asyncio.events.Handle._run
+    
+    def _run(handle):
+        started = time.perf_counter()
+        _original_handle_run(handle)
+        elapsed = time.perf_counter() - started
+        if elapsed >= threshold:
+            logger.warning(f"🐢 Event loop заблокирован на {elapsed * 1000:.0f}ms: {_describe(handle)}")
+    
+    asyncio.events.Handle._run = _run
+    logger.info(f"🐢 Детектор медленных колбэков: порог {threshold * 1000:.0f}ms")
+
+def uninstall_slow_callback_detector():
+    global _original_handle_run
+    if _original_handle_run is not None:
+        asyncio.events.Handle._run = _original_handle_run
+        _original_handle_run = None
+
+# === Снятие профиля ===
+
+class ProfileCapture:
+    """cProfile работающего event loop на N секунд по сигналу или запросу"""
+    
+    def __init__(self, output_dir: Optional[str] = None, default_seconds: Optional[int] = None):
+        self.output_dir = output_dir or SETTINGS.PROFILE_DIR
+        self.default_seconds = default_seconds or SETTINGS.PROFILE_SECONDS
+        self._task = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def install_signal_handler(self, signum: int = getattr(signal, 'SIGUSR1', 0)):
+        """kill -USR1 <pid> — снять профиль на default_seconds"""
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, self.trigger)
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            logger.warning(f"⚠️ Сигнал профилирования недоступен: {e}")
+            return
+        logger.info(f"🔬 Профилирование: kill -USR1 {os.getpid()} ({self.default_seconds}s)")
+    
+    def trigger(self, seconds: Optional[int] = None) -> Optional[asyncio.Task]:
+        """Запустить снятие профиля в фоне; None, если оно уже идёт"""
+        if self.running:
+            logger.warning("⚠️ Профиль уже снимается")
+            return None
+        self._task = asyncio.get_running_loop().create_task(self.capture(seconds))
+        return self._task
+    
+    async def capture(self, seconds: Optional[int] = None) -> str:
+        """Профилировать поток event loop seconds секунд; вернуть путь к .prof"""
+        seconds = seconds or self.default_seconds
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}.prof")
+        
+        profiler = cProfile.Profile()
+        logger.info(f"🔬 Снятие профиля на {seconds}s...")
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        profiler.dump_stats(path)
+        logger.info(f"🔬 Профиль сохранён: {path} (python -m pstats {path})")
+        return path
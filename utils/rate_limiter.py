@@ -0,0 +1,40 @@
+import asyncio
+import time
+from typing import Optional
+
+class TokenBucket:
+    """Token bucket: общий лимит запросов к Telegram API для нескольких задач"""
+    
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (FloodWait): ждут все задачи, а не одна"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # После паузы — без накопленного запаса, чтобы не ударить пачкой запросов
+        self._tokens = 0.0
+        self._updated_at = self._paused_until
+    
+    async def acquire(self, tokens: int = 1):
+        """Дождаться и забрать токены (ожидающие обслуживаются по очереди)"""
+        async with self._lock:
+            while True:
+                paused = self._paused_until - time.monotonic()
+                if paused > 0:
+                    await asyncio.sleep(paused)
+                    continue
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)